@@ -1,6 +1,7 @@
 from django.contrib import admin
+from django.utils import timezone
 
-from .models import File, CarouselColor, Carousel, CarouselDiscount
+from .models import File, CarouselColor, Carousel, CarouselDiscount, ImageJob
 
 # Register your models here.
 
@@ -38,4 +39,18 @@ class CarouselAdmin(admin.ModelAdmin):
 @admin.register(CarouselDiscount)
 class CarouselDiscountAdmin(admin.ModelAdmin):
     list_display = ["id", "url", "created_at"]
-    list_filter = ["created_at"]
\ No newline at end of file
+    list_filter = ["created_at"]
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ["id", "source", "status", "attempts", "run_after", "created_at"]
+    list_filter = ["status", "created_at"]
+    search_fields = ("source",)
+    actions = ["retry"]
+
+    @admin.action(description="Retry the selected jobs")
+    def retry(self, request, queryset):
+        queryset.exclude(status=ImageJob.DONE).update(
+            status=ImageJob.PENDING, attempts=0, run_after=timezone.now()
+        )
@@ -0,0 +1,299 @@
+import os
+import tempfile
+from datetime import timedelta
+from math import ceil
+
+from PIL import Image
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ImageConversion, ImageJob, StoredFile
+from .storage import is_content_name
+
+# Values of ?img= besides a width in pixels
+IMAGE_SIZE_HINTS = {"thumb": 160, "small": 320, "medium": 640, "large": 1280}
+
+
+def load_image(image):
+    """
+    Decode an opened image with its longest side capped at
+    IMAGE_MAX_DIMENSION. JPEGs are decoded straight at a 1/2, 1/4 or 1/8
+    scale with draft(), the rest is shrunk by an integer factor with
+    reduce() before the final resampling. Images without transparency are
+    kept RGB, a quarter smaller than RGBA.
+    """
+    limit = settings.IMAGE_MAX_DIMENSION
+    ratio = limit / max(image.size)
+    if ratio < 1:
+        image.draft(None, (ceil(image.width * ratio), ceil(image.height * ratio)))
+        image.thumbnail((limit, limit), Image.LANCZOS, reducing_gap=2.0)
+    mode = "RGBA" if image.has_transparency_data else "RGB"
+    return image if image.mode == mode else image.convert(mode)
+
+
+def encode_webp(image):
+    """WebP encoding of image, spooled to a temporary file"""
+    file = tempfile.TemporaryFile()
+    image.save(file, format="WEBP", quality=80)
+    file.seek(0)
+    return File(file)
+
+
+def build_images(file, force=False):
+    """
+    WebP version of an image file, None when it is WebP already and within
+    IMAGE_MAX_DIMENSION unless force, the downsized copies for every IMAGE_VARIANT_WIDTHS
+    narrower than it, and its width.
+    """
+    image = Image.open(file)
+    keep = (
+        not force
+        and image.format == "WEBP"
+        and max(image.size) <= settings.IMAGE_MAX_DIMENSION
+    )
+    image = load_image(image)
+    webp = None if keep else encode_webp(image)
+    width = image.width
+
+    # Each copy is scaled down from the previous, wider one
+    variants = {}
+    for variant_width in sorted(settings.IMAGE_VARIANT_WIDTHS, reverse=True):
+        if variant_width < image.width:
+            height = max(round(image.height * variant_width / image.width), 1)
+            image = image.resize((variant_width, height), Image.LANCZOS)
+            variants[variant_width] = encode_webp(image)
+    return webp, variants, width
+
+
+def write_images(field, source, force=False):
+    """
+    Store the images build_images() makes of the source file of a file
+    field. Returns the name of the full size image and the width: name map
+    of the variants, the full size image included. A content addressed
+    source converted before is not converted again unless force.
+    """
+    storage = field.storage
+    if not force:
+        conversion = get_conversion(storage, source)
+        if conversion is not None:
+            return conversion
+
+    written = []
+    webp, variants = None, {}
+    try:
+        with storage.open(source) as file:
+            webp, variants, width = build_images(file, force)
+
+        stem = os.path.splitext(os.path.basename(source))[0]
+        name = source
+        if webp is not None:
+            name = storage.save(field.generate_filename(None, f"{stem}.webp"), webp)
+            written.append(name)
+        # The full size image is the widest entry of the srcset
+        names = {str(width): name}
+        for variant_width, content in variants.items():
+            variant_name = field.generate_filename(
+                None, f"{stem}_{variant_width}w.webp"
+            )
+            names[str(variant_width)] = storage.save(variant_name, content)
+            written.append(names[str(variant_width)])
+    except Exception:
+        StoredFile.objects.discard(written)
+        raise
+    finally:
+        for content in [webp, *variants.values()]:
+            if content is not None:
+                content.close()
+
+    if is_content_name(source):
+        ImageConversion.objects.update_or_create(
+            source=source, defaults={"name": name, "variants": names}
+        )
+    return name, names
+
+
+def get_conversion(storage, source):
+    """
+    (name, names) write_images() returned for the same source before, if
+    its files are still stored
+    """
+    if not is_content_name(source):
+        return None
+    conversion = ImageConversion.objects.filter(source=source).first()
+    if conversion is None:
+        return None
+    names = {conversion.name, *conversion.variants.values()}
+    if not all(storage.exists(name) for name in names):
+        return None
+    return conversion.name, conversion.variants
+
+
+def write_model_images(label, field_name, source, force=False):
+    """
+    write_images() for a field given by model label, for process pools.
+    Returns (name, names, None), or (None, None, error) on failure.
+    """
+    field = apps.get_model(label)._meta.get_field(field_name)
+    try:
+        return *write_images(field, source, force), None
+    except Exception as exc:
+        return None, None, f"{type(exc).__name__}: {exc}"
+
+
+def claim_jobs(limit):
+    """
+    Mark up to limit due jobs as running and return them. Rows locked by
+    another worker are skipped, jobs of a crashed worker are taken back
+    after IMAGE_JOB_TIMEOUT as a failed attempt: an image killing the
+    worker is not retried forever.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.IMAGE_JOB_TIMEOUT)
+    with transaction.atomic():
+        jobs = list(
+            ImageJob.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(
+                Q(status=ImageJob.PENDING, run_after__lte=now)
+                | Q(status=ImageJob.RUNNING, locked_at__lt=stale)
+            )
+            .select_related("content_type")
+            .order_by("run_after")[:limit]
+        )
+        claimed = []
+        for job in jobs:
+            if job.status == ImageJob.RUNNING:
+                job.attempts += 1
+                job.error = "Abandoned by a stopped worker"
+            if job.attempts >= settings.IMAGE_JOB_MAX_ATTEMPTS:
+                job.status = ImageJob.FAILED
+                job.locked_at = None
+            else:
+                job.status = ImageJob.RUNNING
+                job.locked_at = now
+                claimed.append(job)
+            job.updated_at = now
+        ImageJob.objects.bulk_update(
+            jobs, ["status", "locked_at", "attempts", "error", "updated_at"]
+        )
+    return claimed
+
+
+def process_job(job):
+    """
+    Convert the source of the job to WebP, write its variants and swap them
+    into the row, unless the row was deleted or given another file in the
+    meantime. Failures are retried with an exponential delay up to
+    IMAGE_JOB_MAX_ATTEMPTS times.
+    """
+    model = job.content_type.model_class()
+    field = model._meta.get_field(job.field_name)
+
+    if not is_current(model, job):
+        return finish(job)
+
+    try:
+        name, names = write_images(field, job.source)
+    except Exception as exc:
+        return fail(job, exc)
+
+    try:
+        with transaction.atomic():
+            instance = (
+                model.objects.select_for_update().filter(pk=job.object_id).first()
+            )
+            if instance is None or getattr(instance, job.field_name).name != job.source:
+                StoredFile.objects.discard(set(names.values()) - {job.source})
+                return finish(job)
+
+            # save() rather than update() so the cache invalidation signals
+            # run, and the reference to the source is released with the file
+            setattr(instance, job.field_name, name)
+            instance.variants = names
+            instance.save(update_fields=[job.field_name, "variants", "updated_at"])
+            check_stored(field.storage, names.values())
+    except FileNotFoundError as exc:
+        return fail(job, exc)
+    return finish(job)
+
+
+def check_stored(storage, names):
+    """
+    Raise FileNotFoundError unless every file is stored. Once referenced a
+    file can no longer be discarded, but a file shared with other rows may
+    have been between its write and the reference.
+    """
+    missing = [name for name in names if not storage.exists(name)]
+    if missing:
+        raise FileNotFoundError(f"Discarded meanwhile: {', '.join(missing)}")
+
+
+def is_current(model, job):
+    return model.objects.filter(
+        pk=job.object_id, **{job.field_name: job.source}
+    ).exists()
+
+
+def finish(job):
+    job.status = ImageJob.DONE
+    job.locked_at = None
+    job.error = ""
+    job.save(update_fields=["status", "locked_at", "error", "updated_at"])
+    return job
+
+
+def fail(job, exc):
+    job.attempts += 1
+    job.locked_at = None
+    job.error = f"{type(exc).__name__}: {exc}"
+    if job.attempts >= settings.IMAGE_JOB_MAX_ATTEMPTS:
+        job.status = ImageJob.FAILED
+    else:
+        job.status = ImageJob.PENDING
+        delay = settings.IMAGE_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.run_after = timezone.now() + timedelta(seconds=delay)
+    job.save()
+    return job
+
+
+def get_requested_width(request):
+    """
+    Width asked for with ?img=, a name of IMAGE_SIZE_HINTS or a number of
+    pixels, rounded up to the closest IMAGE_VARIANT_WIDTHS. None without a
+    valid hint or when wider than every variant: the full size image. The
+    result goes into cache keys, arbitrary widths must not multiply them.
+    """
+    value = request.GET.get("img", "") if request is not None else ""
+    if value in IMAGE_SIZE_HINTS:
+        width = IMAGE_SIZE_HINTS[value]
+    elif value.isdigit() and int(value) > 0:
+        width = int(value)
+    else:
+        return None
+    wide_enough = [size for size in settings.IMAGE_VARIANT_WIDTHS if size >= width]
+    return min(wide_enough) if wide_enough else None
+
+
+def pick_variant(name, variants, width):
+    """Name of the narrowest variant at least width wide, name by default"""
+    if width and variants:
+        wide_enough = [int(key) for key in variants if int(key) >= width]
+        if wide_enough:
+            return variants[str(min(wide_enough))]
+    return name
+
+
+def get_image_url(storage, name, variants=None, request=None):
+    """URL of the variant of an image the request asks for with ?img="""
+    if not name:
+        return None
+    url = storage.url(pick_variant(name, variants, get_requested_width(request)))
+    return request.build_absolute_uri(url) if request else url
+
+
+def get_srcset(variants, url):
+    """Width: URL of every variant, narrowest first"""
+    return {key: url(variants[key]) for key in sorted(variants or {}, key=int)}
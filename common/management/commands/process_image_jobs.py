@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from common.images import claim_jobs, process_job
+from common.models import ImageJob
+
+
+class Command(BaseCommand):
+    help = "Convert the queued images to WebP in the background"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Process the due jobs and exit"
+        )
+        parser.add_argument("--batch-size", type=int, default=10)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5,
+            help="Seconds to wait when there is no job to process",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = claim_jobs(options["batch_size"])
+            for job in jobs:
+                process_job(job)
+                if job.status == ImageJob.DONE:
+                    self.stdout.write(f"Converted {job.source}")
+                else:
+                    self.stderr.write(f"{job.source}: {job.error}")
+
+            if not jobs:
+                if options["once"]:
+                    return
+                time.sleep(options["sleep"])
@@ -0,0 +1,151 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .models import StoredFile
+from .storage import is_content_name
+
+# Content addressed names never change content
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a media file referenced by a stored row. With
+    MEDIA_ACCEL_REDIRECT_PREFIX set nginx transfers the file, Range
+    requests included, through X-Accel-Redirect once the checks passed.
+    Without it the file is streamed from here, for development.
+    """
+    full_path = get_media_path(path)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+
+    prefix = settings.MEDIA_ACCEL_REDIRECT_PREFIX
+    if prefix:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(path)
+    else:
+        response = serve_file(request, full_path, content_type)
+
+    if encoding:
+        response["Content-Encoding"] = encoding
+    if is_content_name(path):
+        patch_cache_control(
+            response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+        )
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_MAX_AGE)
+    return response
+
+
+def get_media_path(path):
+    """
+    Absolute path of a media file, 404 for paths outside MEDIA_ROOT, hidden
+    files and names no row references
+    """
+    if any(part.startswith(".") for part in path.split("/")):
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not StoredFile.objects.filter(name=path, references__gt=0).exists():
+        raise Http404
+    return full_path
+
+
+def serve_file(request, full_path, content_type):
+    """Response streaming a file, a single byte range of it if requested"""
+    try:
+        stat = os.stat(full_path)
+    except FileNotFoundError:
+        raise Http404
+    size = stat.st_size
+    # The format of nginx
+    etag = f'"{int(stat.st_mtime):x}-{size:x}"'
+    last_modified = http_date(stat.st_mtime)
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if response is not None:
+        return response
+
+    byte_range = get_byte_range(request, size, etag, last_modified)
+    if byte_range is None:
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    elif byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(full_path, start, end - start + 1),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = last_modified
+    return response
+
+
+def get_byte_range(request, size, etag, last_modified):
+    """
+    (first, last) byte of the single range requested, False when it is not
+    satisfiable, None to send the whole file. Multiple ranges and ranges
+    of an If-Range that no longer matches get the whole file.
+    """
+    header = request.headers.get("Range")
+    if not header:
+        return None
+    if_range = request.headers.get("If-Range")
+    if if_range and if_range not in (etag, last_modified):
+        return None
+
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # The last bytes of the file
+        suffix = int(last)
+        if not suffix or not size:
+            return False
+        return max(size - suffix, 0), size - 1
+
+    first = int(first)
+    if last and int(last) < first:
+        # Invalid, ignored
+        return None
+    if first >= size:
+        return False
+    return first, (min(int(last), size - 1) if last else size - 1)
+
+
+def read_range(full_path, start, length, chunk_size=64 * 1024):
+    with open(full_path, "rb") as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
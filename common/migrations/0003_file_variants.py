@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("common", "0002_image_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="variants",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Variants"
+            ),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 5.2 on 2026-10-18 12:20
+
+import uuid
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def count_references(apps, schema_editor):
+    """StoredFile rows for the files and variants stored so far"""
+    counts = Counter()
+    for label, field_name in [
+        ("common.File", "file"),
+        ("products.ProductImage", "image"),
+    ]:
+        rows = apps.get_model(label).objects.values_list(field_name, "variants")
+        for name, variants in rows.iterator():
+            counts.update({name, *variants.values()} - {""})
+
+    StoredFile = apps.get_model("common", "StoredFile")
+    StoredFile.objects.bulk_create(
+        [StoredFile(name=name, references=count) for name, count in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("common", "0003_file_variants"),
+        ("products", "0006_productimage_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageConversion",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Created at"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Updated at"),
+                ),
+                (
+                    "source",
+                    models.CharField(
+                        max_length=255, unique=True, verbose_name="Source file"
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, verbose_name="Name")),
+                ("variants", models.JSONField(default=dict, verbose_name="Variants")),
+            ],
+            options={
+                "verbose_name": "Image Conversion",
+                "verbose_name_plural": "Image Conversions",
+            },
+        ),
+        migrations.CreateModel(
+            name="StoredFile",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Created at"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Updated at"),
+                ),
+                (
+                    "name",
+                    models.CharField(max_length=255, unique=True, verbose_name="Name"),
+                ),
+                (
+                    "references",
+                    models.IntegerField(default=0, verbose_name="References"),
+                ),
+            ],
+            options={
+                "verbose_name": "Stored File",
+                "verbose_name_plural": "Stored Files",
+            },
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,203 @@
-import os
+from collections import Counter
 
-from PIL import Image
-from io import BytesIO
-
-from django.db import models
-from django.core.files.base import ContentFile
+from django.db import models, transaction
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.core.validators import FileExtensionValidator
+from django.db.models import F, Q
+from django.utils import timezone
 
-from core import settings
 from utils.base import BaseModel
 
 
 # Create your models here.
+class ImageJobManager(models.Manager):
+    def queue(self, instances, field_name, uploaded=False):
+        """
+        Queue the WebP conversion of the images stored in field_name and the
+        generation of their variants, unless done or queued already. With
+        uploaded, the images were just uploaded and the finished jobs of the
+        same sources are queued anew.
+        """
+        jobs = []
+        for instance in instances:
+            name = getattr(instance, field_name).name
+            if name and (not name.lower().endswith(".webp") or not instance.variants):
+                jobs.append(
+                    ImageJob(
+                        content_type=ContentType.objects.get_for_model(instance),
+                        object_id=instance.pk,
+                        field_name=field_name,
+                        source=name,
+                    )
+                )
+        self.bulk_create(jobs, ignore_conflicts=True)
+        if uploaded and jobs:
+            # Identical bytes uploaded again get the name of a source
+            # processed before. Pending and running jobs are left alone, a
+            # failed one starts over with its attempts
+            sources = Q()
+            for job in jobs:
+                sources |= Q(
+                    content_type=job.content_type,
+                    object_id=job.object_id,
+                    field_name=job.field_name,
+                    source=job.source,
+                )
+            now = timezone.now()
+            self.filter(sources, status__in=[ImageJob.DONE, ImageJob.FAILED]).update(
+                status=ImageJob.PENDING,
+                attempts=0,
+                run_after=now,
+                error="",
+                updated_at=now,
+            )
+        return jobs
+
+
+class ImageJob(BaseModel):
+    """Background processing of a stored image, see common.images"""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.UUIDField()
+    field_name = models.CharField(max_length=100)
+    source = models.CharField(max_length=255, verbose_name="Source file")
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name="Status"
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Attempts")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Run after")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="Locked at")
+    error = models.TextField(blank=True, verbose_name="Error")
+
+    objects = ImageJobManager()
+
+    class Meta:
+        verbose_name = "Image Job"
+        verbose_name_plural = "Image Jobs"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content_type", "object_id", "field_name", "source"],
+                name="image_job_unique_source",
+            )
+        ]
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        return f"ID: {self.id} | Source: {self.source} | Status: {self.status}"
+
+
+class StoredFileManager(models.Manager):
+    def reserve(self, name):
+        """
+        Lock the row of name, created without references if missing, until
+        the transaction ends: a discard() waits for the references taken
+        meanwhile instead of deleting the file. See common.storage.
+        """
+        while True:
+            self.bulk_create([StoredFile(name=name)], ignore_conflicts=True)
+            # Retried if a discard() deleted the row in between
+            if self.select_for_update().filter(name=name).values_list("pk"):
+                return
+
+    def acquire(self, names):
+        """Count one more reference to each stored file name"""
+        counts = Counter(name for name in names if name)
+        self.bulk_create(
+            [StoredFile(name=name) for name in counts], ignore_conflicts=True
+        )
+        for count, group in group_by_count(counts).items():
+            self.filter(name__in=group).update(
+                references=F("references") + count, updated_at=timezone.now()
+            )
+
+    def release(self, names):
+        """
+        Count one reference less to each stored file name. Files no longer
+        referenced are discarded once the transaction commits.
+        """
+        counts = Counter(name for name in names if name)
+        for count, group in group_by_count(counts).items():
+            self.filter(name__in=group).update(
+                references=F("references") - count, updated_at=timezone.now()
+            )
+        if counts:
+            transaction.on_commit(lambda: self.discard(counts))
+
+    def discard(self, names):
+        """
+        Delete the files of names that nothing references, and their rows.
+        The rows stay locked while the files are deleted, reserve() and
+        acquire() of the same names wait.
+        """
+        with transaction.atomic():
+            unused = list(
+                self.select_for_update()
+                .filter(name__in=set(names), references__lte=0)
+                .values_list("name", flat=True)
+            )
+            for name in unused:
+                default_storage.delete(name)
+            self.filter(name__in=unused).delete()
+
+
+def group_by_count(counts):
+    groups = {}
+    for name, count in counts.items():
+        groups.setdefault(count, []).append(name)
+    return groups
+
+
+class StoredFile(BaseModel):
+    """
+    Number of rows referencing a file of the default storage. Uploads are
+    content addressed, see common.storage, so one file can back many rows
+    and is only deleted with its last reference.
+    """
+
+    name = models.CharField(max_length=255, unique=True, verbose_name="Name")
+    references = models.IntegerField(default=0, verbose_name="References")
+
+    objects = StoredFileManager()
+
+    class Meta:
+        verbose_name = "Stored File"
+        verbose_name_plural = "Stored Files"
+
+    def __str__(self):
+        return f"ID: {self.id} | Name: {self.name} | References: {self.references}"
+
+
+class ImageConversion(BaseModel):
+    """
+    What an image job made of a source file, reused when the same bytes
+    are uploaded again instead of converting them twice
+    """
+
+    source = models.CharField(max_length=255, unique=True, verbose_name="Source file")
+    name = models.CharField(max_length=255, verbose_name="Name")
+    variants = models.JSONField(default=dict, verbose_name="Variants")
+
+    class Meta:
+        verbose_name = "Image Conversion"
+        verbose_name_plural = "Image Conversions"
+
+    def __str__(self):
+        return f"ID: {self.id} | Source: {self.source} | Name: {self.name}"
+
+
 class File(BaseModel):
     file = models.FileField(
         upload_to="uploads/files",
@@ -23,6 +208,10 @@ class File(BaseModel):
             )
         ],
     )
+    # Width: name of the downsized copies, see common.images
+    variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Variants"
+    )
 
     class Meta:
         verbose_name = "File"
@@ -40,30 +229,16 @@ class File(BaseModel):
             )
 
     def save(self, *args, **kwargs):
-        is_webp = self.file.name.split(".")[-1].lower() == "webp"
-        original_path = None
-
-        if not is_webp and self.file:
-            original_path = os.path.join(
-                settings.MEDIA_ROOT + "/uploads/files/", self.file.name
-            )
-
-        super().save(*args, **kwargs)
-
-        if not is_webp:
-            image = Image.open(self.file)
-            image = image.convert("RGBA")
-
-            webp_io = BytesIO()
-            image.save(webp_io, format="WEBP", quality=80)
-
-            webp_path = os.path.splitext(os.path.basename(self.file.name))[0] + ".webp"
-            self.file.save(webp_path, ContentFile(webp_io.getvalue()), save=False)
+        uploaded = not self.file._committed
+        if uploaded:
+            # A new upload, the variants of the previous one do not apply
+            self.variants = {}
+        # The stored file stays reserved until its reference is counted
+        with transaction.atomic():
             super().save(*args, **kwargs)
-
-            # Deleting original image
-            if original_path and os.path.exists(original_path):
-                os.remove(original_path)
+            # The original is served until the process_image_jobs worker
+            # swaps in the WebP version and its variants
+            ImageJob.objects.queue([self], "file", uploaded)
 
 
 class CarouselColor(BaseModel):
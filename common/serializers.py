@@ -1,20 +1,28 @@
 from rest_framework import serializers
 
+from .images import get_image_url, get_srcset
 from .models import File, CarouselColor, Carousel, CarouselDiscount
 
 
 class FileSerializer(serializers.ModelSerializer):
     url = serializers.SerializerMethodField(source="file", read_only=True)
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = File
-        fields = ["id", "url"]
+        fields = ["id", "url", "srcset"]
 
     def get_url(self, obj):
+        return get_image_url(
+            obj.file.storage, obj.file.name, obj.variants, self.context.get("request")
+        )
+
+    def get_srcset(self, obj):
         request = self.context.get("request")
-        if obj.file:
-            return request.build_absolute_uri(obj.file.url) if request else obj.file.url
-        return None
+        return get_srcset(
+            obj.variants,
+            lambda name: get_image_url(obj.file.storage, name, request=request),
+        )
 
 
 class CarouselColorSerializer(serializers.Serializer):
@@ -45,4 +53,4 @@ class CarouselDiscountSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CarouselDiscount
-        fields = ["id", "url", "image"]
\ No newline at end of file
+        fields = ["id", "url", "image"]
@@ -0,0 +1,55 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from utils.cache import invalidate_tags, model_tag
+
+from .models import Carousel, CarouselColor, CarouselDiscount, File, StoredFile
+
+
+@receiver([post_save, post_delete], sender=File)
+@receiver([post_save, post_delete], sender=Carousel)
+@receiver([post_save, post_delete], sender=CarouselColor)
+@receiver([post_save, post_delete], sender=CarouselDiscount)
+def invalidate_table(sender, **kwargs):
+    invalidate_tags(model_tag(sender))
+
+
+def get_stored_names(name, variants):
+    return {name, *(variants or {}).values()} - {""}
+
+
+def track_references(model, field_name):
+    """
+    Keep StoredFile in step with the image stored in field_name of model
+    rows and its variants. bulk_create() and bulk_update() send no signals,
+    their callers acquire and release the names themselves.
+    """
+
+    def remember(sender, instance, **kwargs):
+        previous = None
+        if not instance._state.adding:
+            previous = (
+                sender.objects.filter(pk=instance.pk)
+                .values_list(field_name, "variants")
+                .first()
+            )
+        instance._stored_names = get_stored_names(*previous) if previous else set()
+
+    def count(sender, instance, **kwargs):
+        names = get_stored_names(getattr(instance, field_name).name, instance.variants)
+        previous = instance.__dict__.pop("_stored_names", set())
+        StoredFile.objects.acquire(names - previous)
+        StoredFile.objects.release(previous - names)
+
+    def forget(sender, instance, **kwargs):
+        StoredFile.objects.release(
+            get_stored_names(getattr(instance, field_name).name, instance.variants)
+        )
+
+    uid = f"{model._meta.label}.{field_name}"
+    pre_save.connect(remember, sender=model, weak=False, dispatch_uid=uid)
+    post_save.connect(count, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(forget, sender=model, weak=False, dispatch_uid=uid)
+
+
+track_references(File, "file")
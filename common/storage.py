@@ -0,0 +1,91 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+from .models import StoredFile
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage naming every file after the SHA-256 of its content,
+    <upload directory>/<first two hex digits>/<digest><extension>. The same
+    bytes are stored once, and a name never points at other content, so
+    URLs can be cached forever. References are counted by StoredFile.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+
+        name = self.get_content_name(name, content)
+        # The lock keeps a discard() of the same bytes from deleting the
+        # file between exists() and the reference of the caller, provided
+        # the caller counts it in the same transaction
+        with transaction.atomic():
+            StoredFile.objects.reserve(name)
+            if self.exists(name):
+                return name
+            return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # An existing file of that name holds the same bytes
+        return name
+
+    def _save(self, name, content):
+        """
+        Write to a temporary file renamed into place, concurrent saves of
+        the same content never expose a partly written file
+        """
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary, self.file_permissions_mode)
+            os.replace(temporary, full_path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return str(name).replace("\\", "/")
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        digest = digest.hexdigest()
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+
+def is_content_name(name):
+    """Whether name was given by ContentAddressedStorage"""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    directory = os.path.basename(os.path.dirname(name))
+    return (
+        len(stem) == 64
+        and stem[:2] == directory
+        and all(char in "0123456789abcdef" for char in stem)
+    )
@@ -1,3 +1,432 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image
+from PIL.JpegImagePlugin import JpegImageFile
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from .images import claim_jobs, get_requested_width, process_job, write_images
+from .models import File, ImageConversion, ImageJob, StoredFile
+from .serializers import FileSerializer
+from .storage import ContentAddressedStorage
+
 
 # Create your tests here.
+
+
+def make_png(size=(400, 300)):
+    output = BytesIO()
+    Image.new("RGB", size, "red").save(output, format="PNG")
+    return ContentFile(output.getvalue(), name="photo.png")
+
+
+@override_settings(IMAGE_JOB_MAX_ATTEMPTS=2, IMAGE_JOB_RETRY_DELAY=60)
+class ImageJobTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_save_queues_instead_of_converting(self):
+        file = File.objects.create(file=make_png())
+
+        self.assertTrue(file.file.name.endswith(".png"))
+        job = ImageJob.objects.get()
+        self.assertEqual((job.source, job.status), (file.file.name, ImageJob.PENDING))
+
+        # Saving again does not queue the same source twice
+        file.save()
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+    def test_worker_swaps_in_webp(self):
+        file = File.objects.create(file=make_png())
+        original = file.file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("process_image_jobs", "--once", stdout=StringIO())
+
+        file.refresh_from_db()
+        self.assertTrue(file.file.name.endswith(".webp"))
+        self.assertFalse(default_storage.exists(original))
+        with default_storage.open(file.file.name) as webp:
+            self.assertEqual(Image.open(webp).format, "WEBP")
+        self.assertEqual(ImageJob.objects.get().status, ImageJob.DONE)
+        # The WebP version is not queued again
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+        # Variants narrower than the image, and the image itself
+        self.assertEqual(set(file.variants), {"160", "320", "400"})
+        self.assertEqual(file.variants["400"], file.file.name)
+        with default_storage.open(file.variants["160"]) as variant:
+            self.assertEqual(Image.open(variant).size, (160, 120))
+
+    def test_webp_upload_gets_variants(self):
+        output = BytesIO()
+        Image.new("RGB", (400, 300), "red").save(output, format="WEBP")
+        file = File.objects.create(file=ContentFile(output.getvalue(), name="a.webp"))
+
+        process_job(claim_jobs(1)[0])
+
+        file.refresh_from_db()
+        self.assertEqual(file.variants["400"], file.file.name)
+        self.assertEqual(set(file.variants), {"160", "320", "400"})
+
+    def test_identical_uploads_are_stored_once(self):
+        first = File.objects.create(file=make_png())
+        second = File.objects.create(file=make_png())
+
+        name = first.file.name
+        self.assertEqual(second.file.name, name)
+        self.assertRegex(name, r"^uploads/files/([0-9a-f]{2})/\1[0-9a-f]{62}\.png$")
+        self.assertEqual(StoredFile.objects.get(name=name).references, 2)
+
+        # The file goes with its last reference
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_discarded_files_are_written_again(self):
+        file = File.objects.create(file=make_png())
+        name = file.file.name
+        StoredFile.objects.filter(name=name).update(references=0)
+        StoredFile.objects.discard([name])
+        self.assertFalse(default_storage.exists(name))
+
+        self.assertEqual(default_storage.save("uploads/files/a.png", make_png()), name)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_swap_fails_when_written_files_were_discarded(self):
+        File.objects.create(file=make_png())
+
+        def write_and_lose_one(field, source):
+            name, names = write_images(field, source)
+            default_storage.delete(names["160"])
+            return name, names
+
+        with mock.patch("common.images.write_images", write_and_lose_one):
+            job = process_job(claim_jobs(1)[0])
+        self.assertEqual((job.status, job.attempts), (ImageJob.PENDING, 1))
+        self.assertIn("Discarded meanwhile", job.error)
+        # Nothing was swapped in
+        self.assertTrue(File.objects.get().file.name.endswith(".png"))
+
+    def test_conversion_of_identical_bytes_is_reused(self):
+        first = File.objects.create(file=make_png())
+        with self.captureOnCommitCallbacks(execute=True):
+            process_job(claim_jobs(1)[0])
+        first.refresh_from_db()
+        self.assertEqual(ImageConversion.objects.get().name, first.file.name)
+
+        # Uploaded again after the first source was deleted
+        second = File.objects.create(file=make_png())
+        with mock.patch("common.images.build_images") as build_images:
+            with self.captureOnCommitCallbacks(execute=True):
+                process_job(claim_jobs(1)[0])
+        build_images.assert_not_called()
+
+        second.refresh_from_db()
+        self.assertEqual(
+            (second.file.name, second.variants), (first.file.name, first.variants)
+        )
+        for name in first.variants.values():
+            self.assertEqual(StoredFile.objects.get(name=name).references, 2)
+        self.assertEqual(StoredFile.objects.count(), len(first.variants))
+
+    def test_new_upload_resets_variants(self):
+        file = File.objects.create(file=make_png())
+        process_job(claim_jobs(1)[0])
+        file.refresh_from_db()
+
+        file.file = make_png()
+        file.save()
+
+        self.assertEqual(file.variants, {})
+        self.assertEqual(
+            ImageJob.objects.filter(status=ImageJob.PENDING).get().source,
+            file.file.name,
+        )
+
+    def test_saving_again_keeps_running_and_failed_jobs(self):
+        file = File.objects.create(file=make_png())
+        job = claim_jobs(1)[0]
+        ImageJob.objects.update(attempts=1)
+
+        # A second worker must not get the job being converted
+        file.save()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.RUNNING, 1))
+        self.assertEqual(claim_jobs(1), [])
+
+        # Nor does an unrelated edit give a failed job its attempts back
+        ImageJob.objects.update(status=ImageJob.FAILED, attempts=2)
+        file.save()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.FAILED, 2))
+
+        # Uploading it again does
+        file.file = make_png()
+        file.save()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.PENDING, 0))
+
+    @override_settings(IMAGE_MAX_DIMENSION=200, IMAGE_VARIANT_WIDTHS=[160])
+    def test_large_images_are_capped(self):
+        output = BytesIO()
+        Image.new("RGB", (1600, 1200), "red").save(output, format="JPEG")
+        file = File.objects.create(file=ContentFile(output.getvalue(), name="a.jpg"))
+
+        draft = JpegImageFile.draft
+        with mock.patch.object(
+            JpegImageFile, "draft", autospec=True, side_effect=draft
+        ) as draft:
+            process_job(claim_jobs(1)[0])
+        # JPEGs are decoded at a reduced scale
+        self.assertTrue(draft.called)
+
+        file.refresh_from_db()
+        with default_storage.open(file.file.name) as webp:
+            image = Image.open(webp)
+            self.assertEqual((image.size, image.mode), ((200, 150), "RGB"))
+        self.assertEqual(set(file.variants), {"160", "200"})
+
+    def test_transparency_is_kept(self):
+        output = BytesIO()
+        Image.new("RGBA", (400, 300), (255, 0, 0, 0)).save(output, format="PNG")
+        file = File.objects.create(file=ContentFile(output.getvalue(), name="a.png"))
+
+        process_job(claim_jobs(1)[0])
+
+        file.refresh_from_db()
+        for name in file.variants.values():
+            with default_storage.open(name) as webp:
+                self.assertEqual(Image.open(webp).mode, "RGBA")
+
+    def test_serializer_srcset_and_size_hint(self):
+        file = File.objects.create(file=make_png())
+        process_job(claim_jobs(1)[0])
+        file.refresh_from_db()
+
+        request = RequestFactory().get("/", {"img": "thumb"})
+        data = FileSerializer(file, context={"request": request}).data
+        self.assertEqual(list(data["srcset"]), ["160", "320", "400"])
+        self.assertEqual(data["url"], data["srcset"]["160"])
+        self.assertTrue(data["url"].startswith("http://testserver/media/"))
+
+        # Wider than every variant: the full size image
+        request = RequestFactory().get("/", {"img": "1280"})
+        data = FileSerializer(file, context={"request": request}).data
+        self.assertEqual(data["url"], data["srcset"]["400"])
+
+    def test_requested_width_snaps_to_variant_widths(self):
+        factory = RequestFactory()
+        for value, width in [
+            ("thumb", 160),
+            ("100", 160),
+            ("1000", 1280),
+            ("1280", 1280),
+            ("5000", None),
+            ("0", None),
+            ("x", None),
+        ]:
+            request = factory.get("/", {"img": value})
+            self.assertEqual(get_requested_width(request), width, value)
+
+    def test_widths_share_response_cache_entries(self):
+        cache.clear()
+        url = reverse("carousel_list")
+        self.assertEqual(self.client.get(url, {"img": 1000})["X-Cache"], "MISS")
+        self.assertEqual(self.client.get(url, {"img": 1100})["X-Cache"], "HIT")
+        self.assertEqual(self.client.get(url, {"img": 300})["X-Cache"], "MISS")
+
+    def test_replaced_source_is_not_swapped(self):
+        file = File.objects.create(file=make_png())
+        job = claim_jobs(1)[0]
+        File.objects.filter(pk=file.pk).update(file="uploads/files/other.webp")
+
+        process_job(job)
+
+        file.refresh_from_db()
+        self.assertEqual(file.file.name, "uploads/files/other.webp")
+        self.assertEqual(job.status, ImageJob.DONE)
+
+    def test_failures_are_retried(self):
+        File.objects.create(file=make_png())
+        with mock.patch("common.images.build_images", side_effect=OSError("x")):
+            job = process_job(claim_jobs(1)[0])
+            self.assertEqual((job.status, job.attempts), (ImageJob.PENDING, 1))
+            self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=50))
+            # Not due yet
+            self.assertEqual(claim_jobs(1), [])
+
+            ImageJob.objects.update(run_after=timezone.now())
+            job = process_job(claim_jobs(1)[0])
+            self.assertEqual((job.status, job.attempts), (ImageJob.FAILED, 2))
+            self.assertEqual(job.error, "OSError: x")
+
+    def test_abandoned_jobs_are_claimed_again(self):
+        File.objects.create(file=make_png())
+        self.assertEqual(len(claim_jobs(1)), 1)
+        self.assertEqual(claim_jobs(1), [])
+
+        ImageJob.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        job = claim_jobs(1)[0]
+        self.assertEqual((job.status, job.attempts), (ImageJob.RUNNING, 1))
+
+        # Abandoned again, e.g. the image kills the worker every time
+        ImageJob.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim_jobs(1), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.FAILED, 2))
+        self.assertEqual(job.error, "Abandoned by a stopped worker")
+
+
+@override_settings(MEDIA_ACCEL_REDIRECT_PREFIX="", MEDIA_MAX_AGE=3600)
+class ServeMediaTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.file = File.objects.create(file=make_png())
+        self.url = f"/media/{self.file.file.name}"
+        with default_storage.open(self.file.file.name) as file:
+            self.content = file.read()
+
+    def test_handed_to_nginx(self):
+        with override_settings(MEDIA_ACCEL_REDIRECT_PREFIX="/internal/media/"):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["X-Accel-Redirect"], f"/internal/media/{self.file.file.name}"
+        )
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response.content, b"")
+        # Named after its content
+        self.assertEqual(
+            response["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+
+    def test_served_with_ranges_in_development(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        etag = response["ETag"]
+
+        size = len(self.content)
+        response = self.client.get(self.url, headers={"Range": "bytes=0-9"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 0-9/{size}")
+        self.assertEqual(b"".join(response.streaming_content), self.content[:10])
+
+        response = self.client.get(self.url, headers={"Range": "bytes=-5"})
+        self.assertEqual(b"".join(response.streaming_content), self.content[-5:])
+
+        response = self.client.get(self.url, headers={"Range": f"bytes={size}-"})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{size}")
+
+        # A range of another version of the file gets the whole file
+        response = self.client.get(
+            self.url, headers={"Range": "bytes=0-9", "If-Range": '"other"'}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_names_not_after_content_are_revalidated(self):
+        # Stored before uploads were named after their content
+        name = "uploads/files/legacy.png"
+        with open(default_storage.path(name), "wb") as file:
+            file.write(make_png((10, 10)).read())
+        StoredFile.objects.acquire([name])
+
+        response = self.client.get(f"/media/{name}")
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+
+    def test_unreferenced_and_hidden_files_are_not_served(self):
+        name = default_storage.save("uploads/files/orphan.png", make_png((10, 10)))
+        for url in [
+            f"/media/{name}",
+            "/media/.reencode-checkpoint.json",
+            "/media/../core/settings.py",
+        ]:
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.file.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+
+class StoredFileRaceTestCase(TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_discard_waits_for_an_upload_of_the_same_bytes(self):
+        name = File.objects.create(file=make_png()).file.name
+        # The last reference released, its discard not run yet
+        StoredFile.objects.filter(name=name).update(references=0)
+
+        checked, proceed = threading.Event(), threading.Event()
+        exists = ContentAddressedStorage.exists
+
+        def exists_then_wait(storage, name):
+            result = exists(storage, name)
+            checked.set()
+            proceed.wait(5)
+            return result
+
+        def in_thread(target):
+            def run():
+                try:
+                    target()
+                finally:
+                    connection.close()
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            return thread
+
+        with mock.patch.object(ContentAddressedStorage, "exists", exists_then_wait):
+            upload = in_thread(lambda: File.objects.create(file=make_png()))
+            self.assertTrue(checked.wait(5))
+            discard = in_thread(lambda: StoredFile.objects.discard([name]))
+            # Blocked on the row the upload reserved
+            discard.join(0.5)
+            self.assertTrue(discard.is_alive())
+            proceed.set()
+            upload.join(5)
+            discard.join(5)
+
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
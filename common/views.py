@@ -2,7 +2,12 @@ from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Carousel, CarouselDiscount
+from utils.cache import model_tag
+from utils.conditional import conditional_on
+from utils.response_cache import cache_response
+
+from .images import get_requested_width
+from .models import Carousel, CarouselColor, CarouselDiscount, File
 from .serializers import CarouselSerializer, CarouselDiscountSerializer
 
 
@@ -10,6 +15,10 @@ from .serializers import CarouselSerializer, CarouselDiscountSerializer
 
 
 class ListCarouselAPIView(APIView):
+    cache_tags = [model_tag(Carousel), model_tag(CarouselColor), model_tag(File)]
+
+    @conditional_on(*cache_tags)
+    @cache_response(*cache_tags, params={"img": get_requested_width})
     def get(self, request):
         """Retrieve all carousels"""
         carousels = Carousel.objects.all()
@@ -23,6 +32,10 @@ class ListCarouselAPIView(APIView):
 
 
 class ListCarouselDiscountAPIView(APIView):
+    cache_tags = [model_tag(CarouselDiscount), model_tag(File)]
+
+    @conditional_on(*cache_tags)
+    @cache_response(*cache_tags, params={"img": get_requested_width})
     def get(self, request):
         """Retrieve all carousel discounts"""
         carousel_discounts = CarouselDiscount.objects.all()
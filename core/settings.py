@@ -57,6 +57,7 @@ GLOBAL_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 ]
 
 LOCAL_APPS = [
@@ -126,6 +127,21 @@ DATABASES = {
     }
 }
 
+# Tag versions (utils.cache) must be shared by every gunicorn worker and the
+# sync_discounts scheduler: docker-compose.yml points them at its Redis
+# service. The per-process default is only fit for development.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# Upper bound for utils.response_cache entries, signals expire them earlier
+RESPONSE_CACHE_TIMEOUT = int(os.getenv("RESPONSE_CACHE_TIMEOUT", 60 * 60))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -156,6 +172,12 @@ LANGUAGES = [
 
 LANGUAGE_CODE = "ru"
 
+# PostgreSQL text search configuration per language, "simple" if missing
+SEARCH_CONFIGS = {
+    "ru": "russian",
+    "en": "english",
+}
+
 
 TIME_ZONE = "Asia/Tashkent"
 
@@ -176,6 +198,36 @@ else:
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Uploads are named after their content, see common.storage
+STORAGES = {
+    "default": {"BACKEND": "common.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+# Media is checked by common.media.serve_media and transferred by nginx from
+# this internal location, see nginx.conf. Empty to stream it from Django.
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv(
+    "MEDIA_ACCEL_REDIRECT_PREFIX", "" if DEBUG else "/internal/media/"
+)
+# Seconds media not named after its content may be cached
+MEDIA_MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", 3600))
+
+# Background image conversion, see common.images
+IMAGE_JOB_MAX_ATTEMPTS = int(os.getenv("IMAGE_JOB_MAX_ATTEMPTS", 5))
+# Seconds before the first retry, doubled on every attempt
+IMAGE_JOB_RETRY_DELAY = int(os.getenv("IMAGE_JOB_RETRY_DELAY", 60))
+# Seconds after which a running job is considered abandoned
+IMAGE_JOB_TIMEOUT = int(os.getenv("IMAGE_JOB_TIMEOUT", 600))
+# Downsized copies generated for every image, served through srcset and ?img=
+IMAGE_VARIANT_WIDTHS = [160, 320, 640, 1280]
+# Longest side of the converted images, larger uploads are scaled down
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", 2560))
+
+# Catalog feeds, see products.export
+FEED_BASE_URL = os.getenv("FEED_BASE_URL", "https://api.protouch.uz")
+FEED_PRODUCT_URL = os.getenv("FEED_PRODUCT_URL", "https://protouch.uz/product/{slug}")
+FEED_CURRENCY = os.getenv("FEED_CURRENCY", "UZS")
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
 ]
@@ -199,8 +251,21 @@ AUTHENTICATION_BACKENDS = [
 JAZZMIN_SETTINGS = JAZZMIN_SETTINGS
 SIMPLE_JWT = SIMPLE_JWT
 
+# utils.renderers use orjson when it is installed, set these to
+# rest_framework.renderers.JSONRenderer / rest_framework.parsers.JSONParser
+# to switch back to the stock classes
+JSON_RENDERER_CLASS = os.getenv(
+    "JSON_RENDERER_CLASS", "utils.renderers.FastJSONRenderer"
+)
+JSON_PARSER_CLASS = os.getenv("JSON_PARSER_CLASS", "utils.renderers.FastJSONParser")
+
 REST_FRAMEWORK = {
-    "DEFAULT_RENDERER_CLASSES": ("rest_framework.renderers.JSONRenderer",),
+    "DEFAULT_RENDERER_CLASSES": (JSON_RENDERER_CLASS,),
+    "DEFAULT_PARSER_CLASSES": (
+        JSON_PARSER_CLASS,
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
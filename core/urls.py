@@ -18,8 +18,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf.urls.static import static
-from django.views.static import serve
 
+from common.media import serve_media
 from core import settings
 from users.views import GoogleLoginAPIView
 
@@ -39,17 +39,12 @@ urlpatterns = [
     path(
         "api/v1/auth/social/google/", GoogleLoginAPIView.as_view(), name="google_auth"
     ),
+    # Checked here, transferred by nginx, see common.media
+    re_path(r"^media/(?P<path>.+)$", serve_media, name="media"),
 ]
 
+# nginx serves /static/ in production
 if settings.DEBUG:
     urlpatterns += static(
         settings.STATIC_URL, document_root=settings.STATICFILES_DIRS[0]
     )
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-else:
-    urlpatterns += [
-        re_path(
-            r"^static/(?P<path>.*)$", serve, {"document_root": settings.STATIC_ROOT}
-        ),
-        re_path(r"^media/(?P<path>.*)$", serve, {"document_root": settings.MEDIA_ROOT}),
-    ]
@@ -104,13 +104,7 @@ class OrderItem(BaseModel):
 
     @property
     def order_total(self):
-        discount = getattr(self.product_id, "discount", None)
-        if discount and discount.is_active():
-            discounted_price = discount.discounted_price()
-            total_price = self.quantity * discounted_price
-        else:
-            total_price = self.quantity * self.product_id.price
-        return total_price
+        return self.quantity * self.product_id.effective_price
 
     def __str__(self):
         return f"Order ID: {self.order_id} | Product ID: {self.product_id} | Quantity: {self.quantity}"
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 
 from products.models import Product, ProductDiscount
+from products.serializers import get_cover_image_url
+from utils.serializers import SparseFieldsMixin
 
 
 class OrderItemSerializer(serializers.Serializer):
@@ -43,8 +45,8 @@ class CreateOrderSerializer(serializers.Serializer):
     )
 
 
-class UserOrderItemSerializer(serializers.Serializer):
-    product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
+class UserOrderItemSerializer(SparseFieldsMixin, serializers.Serializer):
+    product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.only("id"))
     title = serializers.CharField(source="product_id.title", read_only=True)
     price = serializers.DecimalField(
         source="product_id.price", max_digits=10, decimal_places=2, read_only=True
@@ -52,18 +54,10 @@ class UserOrderItemSerializer(serializers.Serializer):
     image = serializers.SerializerMethodField()
 
     def get_image(self, obj):
-        image_obj = obj.product_id.product_images.first()
-        if image_obj and image_obj.image:
-            request = self.context.get("request")
-            return (
-                request.build_absolute_uri(image_obj.image.url)
-                if request
-                else image_obj.image.url
-            )
-        return None
+        return get_cover_image_url(obj.product_id, self.context.get("request"))
 
 
-class GetUserOrderSerializer(serializers.Serializer):
+class GetUserOrderSerializer(SparseFieldsMixin, serializers.Serializer):
     id = serializers.UUIDField()
     products = UserOrderItemSerializer(source="order_items", many=True)
     created_at = serializers.DateTimeField()
@@ -6,9 +6,11 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from django.db import transaction
+from django.db.models import Prefetch
 
 from products.models import Product
 from users.models import Customer
+from utils.serializers import get_sparse_fields
 from .models import OrderAddress, OrderPayment, Order, OrderItem, OrderDelivery
 from .serializers import CreateOrderSerializer, GetUserOrderSerializer
 
@@ -56,14 +58,8 @@ class CreateOrderAPIView(APIView):
                         product = Product.objects.filter(id=item["product_id"]).first()
                         quantity = item["quantity"]
 
-                        # Apply discount, if it is active
-                        if (
-                            hasattr(product, "discount")
-                            and product.discount.is_active()
-                        ):
-                            price = product.discounted_price()
-                        else:
-                            price = product.price
+                        # Price after the active discount, if any
+                        price = product.effective_price
 
                         # Create order items
                         OrderItem.objects.create(
@@ -96,9 +92,28 @@ class GetUserOrderAPIView(APIView):
 
     def get(self, request):
         customer = request.user
-        orders = Order.objects.filter(customer_id=customer).prefetch_related(
-            "order_items"
+        orders = Order.objects.filter(customer_id=customer)
+
+        # Only load what ?fields= / ?omit= keep
+        fields = get_sparse_fields(request, ["products"])
+        item_fields = get_sparse_fields(
+            request, ["product_id", "title", "price", "image"], prefix="products"
         )
+        if fields:
+            orders = orders.prefetch_related("order_items")
+            if {"title", "price", "image"} & set(item_fields):
+                # Products in the active language only, without unused columns
+                unused = [
+                    name for name in ["title", "price"] if name not in item_fields
+                ]
+                products = Product.objects.localized(
+                    "short_description", "description", "search_vector", *unused
+                )
+                if "image" in item_fields:
+                    products = products.with_cover_image()
+                orders = orders.prefetch_related(
+                    Prefetch("order_items__product_id", queryset=products)
+                )
 
         if orders is None:
             return Response(
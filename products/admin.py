@@ -1,6 +1,11 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
 from mptt.admin import DraggableMPTTAdmin
 
+from .importer import FORMATS, CatalogImporter, read_rows
 from .models import (
     Category,
     Product,
@@ -11,6 +16,12 @@ from .models import (
 )
 
 
+class ProductImportForm(forms.Form):
+    file = forms.FileField()
+    format = forms.ChoiceField(choices=[(format, format) for format in FORMATS])
+    dry_run = forms.BooleanField(required=False, help_text="Only validate the rows")
+
+
 # Register your models here.
 @admin.register(Brand)
 class BrandAdmin(admin.ModelAdmin):
@@ -48,6 +59,41 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ("title",)
     list_filter = ["is_in_stock", "is_pre_order", "created_at"]
     inlines = [ProductImageInline]
+    change_list_template = "admin/products/product/change_list.html"
+
+    def get_urls(self):
+        return [
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_view),
+                name="products_product_import",
+            )
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            return redirect("admin:products_product_changelist")
+
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        if form.is_valid():
+            importer = CatalogImporter(dry_run=form.cleaned_data["dry_run"])
+            created, errors = importer.run(
+                read_rows(form.cleaned_data["file"], form.cleaned_data["format"])
+            )
+            messages.info(
+                request, f"Created {created} products, rejected {len(errors)} rows"
+            )
+            for number, error in errors[:20]:
+                messages.error(request, f"Line {number}: {error}")
+            return redirect("admin:products_product_changelist")
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Import products",
+            "form": form,
+        }
+        return TemplateResponse(request, "admin/products/product/import.html", context)
 
 
 @admin.register(ProductDetail)
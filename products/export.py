@@ -0,0 +1,147 @@
+import csv
+import json
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils import translation
+
+from .fast_serializers import get_url_builder
+from .models import Product, ProductImage
+
+CSV_COLUMNS = [
+    "id",
+    "title",
+    "description",
+    "link",
+    "image_link",
+    "additional_image_link",
+    "availability",
+    "price",
+    "sale_price",
+    "brand",
+    "product_detail",
+]
+
+
+def iter_products(chunk_size=500):
+    """
+    Every product through a server-side cursor, the images and details are
+    prefetched once per chunk so memory does not grow with the catalog.
+    """
+    images = ProductImage.objects.order_by("order").only("image", "product_id")
+    return (
+        Product.objects.localized("search_vector")
+        .select_related("discount", "brand_id")
+        .prefetch_related(
+            Prefetch("product_images", queryset=images), "product_details"
+        )
+        .order_by("id")
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def get_feed_item(product, image_url):
+    """Fields of a product in Google Merchant terms"""
+    if product.is_pre_order:
+        availability = "preorder"
+    elif product.is_in_stock:
+        availability = "in_stock"
+    else:
+        availability = "out_of_stock"
+
+    images = [image_url(image.image.name) for image in product.product_images.all()]
+    return {
+        "id": str(product.id),
+        "title": product.title,
+        "description": product.description,
+        "link": settings.FEED_PRODUCT_URL.format(id=product.id, slug=product.slug),
+        "image_link": images[0] if images else "",
+        "additional_image_link": images[1:],
+        "availability": availability,
+        "price": f"{product.price} {settings.FEED_CURRENCY}",
+        "sale_price": (
+            f"{product.effective_price} {settings.FEED_CURRENCY}"
+            if product.discount_active
+            else ""
+        ),
+        "brand": product.brand_id.title,
+        "product_detail": [
+            {"name": detail.key, "value": detail.value}
+            for detail in product.product_details.all()
+        ],
+    }
+
+
+class Echo:
+    """File-like object handing back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for item in items:
+        item["additional_image_link"] = ",".join(item["additional_image_link"])
+        item["product_detail"] = "; ".join(
+            f"{detail['name']}: {detail['value']}" for detail in item["product_detail"]
+        )
+        yield writer.writerow([item[column] for column in CSV_COLUMNS])
+
+
+def iter_jsonl(items):
+    for item in items:
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+
+
+def iter_xml(items):
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">\n'
+        "<channel>\n"
+    )
+    for item in items:
+        lines = ["<item>"]
+        for name, value in item.items():
+            if name == "additional_image_link":
+                lines += [f"<g:{name}>{escape(link)}</g:{name}>" for link in value]
+            elif name == "product_detail":
+                lines += [
+                    "<g:product_detail>"
+                    f"<g:attribute_name>{escape(detail['name'])}</g:attribute_name>"
+                    f"<g:attribute_value>{escape(detail['value'])}</g:attribute_value>"
+                    "</g:product_detail>"
+                    for detail in value
+                ]
+            elif value:
+                lines.append(f"<g:{name}>{escape(value)}</g:{name}>")
+        lines.append("</item>\n")
+        yield "\n".join(lines)
+    yield "</channel>\n</rss>\n"
+
+
+# name: (content type, file extension, writer)
+FEEDS = {
+    "csv": ("text/csv", "csv", iter_csv),
+    "jsonl": ("application/x-ndjson", "jsonl", iter_jsonl),
+    "xml": ("application/xml", "xml", iter_xml),
+}
+
+
+def iter_feed(feed, request=None, chunk_size=500):
+    """Lines of the catalog in the given FEEDS format, generated lazily"""
+    _, _, writer = FEEDS[feed]
+    image_url = get_url_builder(
+        ProductImage.image.field.storage, request, host=settings.FEED_BASE_URL
+    )
+    items = (get_feed_item(product, image_url) for product in iter_products(chunk_size))
+    return iter_in_language(translation.get_language(), writer(items))
+
+
+def iter_in_language(language, lines):
+    # A streamed body is consumed after LanguageMiddleware has deactivated
+    # the request's language
+    with translation.override(language):
+        yield from lines
@@ -0,0 +1,43 @@
+from django.db.models import Count, Max, Min, Q
+
+from .models import Brand, Category, Product
+
+FACETS = ("brand", "category", "price", "stock")
+
+
+def get_facets(queryset, names):
+    """Aggregated counts for the filtered products, one query per facet"""
+    products = Product.objects.filter(pk__in=queryset.order_by().values("pk"))
+    facets = {}
+
+    if "brand" in names:
+        facets["brand"] = list(
+            Brand.objects.filter(product__in=products)
+            .order_by()
+            .values("id", "title")
+            .annotate(count=Count("id"))
+            .order_by("-count", "title")
+        )
+
+    if "category" in names:
+        facets["category"] = list(
+            Category.objects.filter(products__in=products)
+            .order_by()
+            .values("id", "title", "slug")
+            .annotate(count=Count("id"))
+            .order_by("-count", "slug")
+        )
+
+    if "price" in names:
+        facets["price"] = products.aggregate(
+            min=Min("effective_price"), max=Max("effective_price")
+        )
+
+    if "stock" in names:
+        facets["stock"] = products.aggregate(
+            in_stock=Count("pk", filter=Q(is_in_stock=True)),
+            out_of_stock=Count("pk", filter=Q(is_in_stock=False)),
+            pre_order=Count("pk", filter=Q(is_pre_order=True)),
+        )
+
+    return facets
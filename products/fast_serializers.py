@@ -0,0 +1,164 @@
+from rest_framework import serializers
+
+from common.images import get_requested_width, get_srcset, pick_variant
+from common.models import File
+
+from .models import Category, ProductImage
+
+# Same formatting as the fields of ProductSerializer
+price_field = serializers.DecimalField(max_digits=10, decimal_places=2)
+datetime_field = serializers.DateTimeField()
+
+# values() columns needed by each ProductSerializer field
+PRODUCT_COLUMNS = {
+    "id": ["id"],
+    "title": ["title"],
+    "short_description": ["short_description"],
+    "slug": ["slug"],
+    "price": ["price"],
+    "is_in_stock": ["is_in_stock"],
+    "is_pre_order": ["is_pre_order"],
+    "image": ["cover_image", "cover_variants"],
+    "discount": [
+        "discount__id",
+        "discount__percent",
+        "discount__start_date",
+        "discount__end_date",
+        "effective_price",
+        "discount_active",
+    ],
+}
+
+
+def get_url_builder(storage, request=None, host=None):
+    """
+    Absolute URL of a stored file name, the scheme and host are resolved
+    once from the request or given as host.
+    """
+    if request is not None:
+        host = request.build_absolute_uri("/")[:-1]
+    if host is None:
+        return storage.url
+
+    def build(name):
+        url = storage.url(name)
+        if url.startswith("/") and not url.startswith("//"):
+            return host + url
+        return request.build_absolute_uri(url) if request else url
+
+    return build
+
+
+def get_product_rows(queryset, fields):
+    """values() of the for_listing() queryset for the ProductSerializer fields"""
+    columns = ["id"] + [column for name in fields for column in PRODUCT_COLUMNS[name]]
+    return queryset.values(*dict.fromkeys(columns))
+
+
+def serialize_products(rows, fields, request=None):
+    """ProductSerializer(many=True).data built from get_product_rows()"""
+    image_url = get_url_builder(ProductImage.image.field.storage, request)
+    width = get_requested_width(request)
+    data = []
+    for row in rows:
+        product = {}
+        for name in fields:
+            if name == "id":
+                product["id"] = str(row["id"])
+            elif name == "price":
+                product["price"] = price_field.to_representation(row["price"])
+            elif name == "image":
+                image = pick_variant(row["cover_image"], row["cover_variants"], width)
+                product["image"] = image_url(image) if image else None
+            elif name == "discount":
+                product["discount"] = serialize_discount(row)
+            elif name in ("title", "short_description"):
+                # The translation descriptors return "" without any value
+                product[name] = row[name] or ""
+            else:
+                product[name] = row[name]
+        data.append(product)
+    return data
+
+
+def serialize_discount(row):
+    if row["discount__id"] is None:
+        return None
+    return {
+        "id": str(row["discount__id"]),
+        "percent": row["discount__percent"],
+        "discounted_price": row["effective_price"],
+        "start_date": datetime_field.to_representation(row["discount__start_date"]),
+        "end_date": datetime_field.to_representation(row["discount__end_date"]),
+        "is_active": row["discount_active"],
+    }
+
+
+def serialize_category_tree(roots, request=None):
+    """
+    CategorySerializer(many=True).data for the root categories in three
+    queries: roots with their image, children, and the children's brands.
+    """
+    file_url = get_url_builder(File.file.field.storage, request)
+    width = get_requested_width(request)
+    root_rows = list(
+        roots.values(
+            "id",
+            "title",
+            "slug",
+            "is_carousel",
+            "image_id",
+            "image_id__file",
+            "image_id__variants",
+        )
+    )
+    child_rows = list(
+        Category.objects.filter(parent_id__in=[row["id"] for row in root_rows]).values(
+            "id", "title", "slug", "parent_id"
+        )
+    )
+    brand_rows = (
+        Category.brands.through.objects.filter(
+            category_id__in=[row["id"] for row in child_rows]
+        )
+        .order_by("brand__title", "brand_id")
+        .values_list("category_id", "brand_id", "brand__title")
+    )
+
+    brands = {}
+    for category_id, brand_id, title in brand_rows:
+        brands.setdefault(category_id, []).append({"id": str(brand_id), "title": title})
+
+    children = {}
+    for row in child_rows:
+        children.setdefault(row["parent_id"], []).append(
+            {
+                "id": str(row["id"]),
+                "title": row["title"] or "",
+                "slug": row["slug"],
+                "brands": brands.get(row["id"], []),
+            }
+        )
+
+    data = []
+    for row in root_rows:
+        image = None
+        if row["image_id"] is not None:
+            name = row["image_id__file"]
+            variants = row["image_id__variants"]
+            image = {
+                "id": str(row["image_id"]),
+                "url": file_url(pick_variant(name, variants, width)) if name else None,
+                "srcset": get_srcset(variants, file_url),
+            }
+        data.append(
+            {
+                "id": str(row["id"]),
+                "title": row["title"] or "",
+                "slug": row["slug"],
+                "is_carousel": row["is_carousel"],
+                "image": image,
+                "children": children.get(row["id"], []),
+            }
+        )
+    return data
@@ -1,7 +1,18 @@
-from django.utils import translation
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 
 from .models import Product, Category
+from .search import search_products
+
+
+class StableOrderingFilter(filters.OrderingFilter):
+    """Break ties on the primary key so that pages never overlap"""
+
+    def filter(self, qs, value):
+        qs = super().filter(qs, value)
+        if value:
+            qs = qs.order_by(*qs.query.order_by, "id")
+        return qs
 
 
 class ProductFilter(filters.FilterSet):
@@ -10,6 +21,12 @@ class ProductFilter(filters.FilterSet):
     )
     slug = filters.CharFilter(method="filter_by_slug")
     brand = filters.CharFilter(method="filter_by_brand")
+    q = filters.CharFilter(method="filter_by_search")
+    min_price = filters.NumberFilter(field_name="effective_price", lookup_expr="gte")
+    max_price = filters.NumberFilter(field_name="effective_price", lookup_expr="lte")
+    ordering = StableOrderingFilter(
+        fields=("created_at", "price", "effective_price", "title")
+    )
 
     class Meta:
         model = Product
@@ -17,30 +34,22 @@ class ProductFilter(filters.FilterSet):
 
     def filter_by_slug(self, queryset, name, value):
         slugs = [slug.strip() for slug in value.split(",") if slug.strip()]
-        lang = self.request.query_params.get("lang", None)
-        if lang in ["ru", "uz", "en"]:
-            translation.activate(lang)
-
-        category_ids = set()
-
-        for slug in slugs:
-            if "/" in slug:
-                # It's a full path to a child: find exact match
-                category = Category.objects.filter(slug=slug).first()
-                if category:
-                    category_ids.add(category.id)
-            else:
-                # It's a parent: include parent and its children
-                parent = Category.objects.filter(slug=slug, parent=None).first()
-                if parent:
-                    children_ids = parent.children.values_list("id", flat=True)
-                    category_ids.add(parent.id)
-                    category_ids.update(children_ids)
-
-        if category_ids:
-            return queryset.filter(categories__in=category_ids).distinct()
-        return queryset.none()
+
+        # Categories whose subtree contains the product's category
+        requested = Category.objects.filter(
+            slug__in=slugs,
+            tree_id=OuterRef("category__tree_id"),
+            lft__lte=OuterRef("category__lft"),
+            rght__gte=OuterRef("category__rght"),
+        )
+        product_categories = Product.categories.through.objects.filter(
+            Exists(requested), product_id=OuterRef("pk")
+        )
+        return queryset.filter(Exists(product_categories))
 
     def filter_by_brand(self, queryset, name, value):
         brand_titles = [v.strip() for v in value.split(",") if v.strip()]
-        return queryset.filter(brand_id__title__in=brand_titles).distinct()
+        return queryset.filter(brand_id__title__in=brand_titles)
+
+    def filter_by_search(self, queryset, name, value):
+        return search_products(queryset, value)
@@ -0,0 +1,191 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.utils.text import slugify
+
+from common.models import ImageJob, StoredFile
+from utils.cache import invalidate_tags, model_tag
+
+from .models import Brand, Category, Product, ProductDetail, ProductImage
+from .pricing import refresh_effective_prices
+from .search import update_search_vectors, update_suggest_terms
+from .serializers import ProductImportSerializer
+
+FORMATS = ("csv", "jsonl")
+# Columns of a CSV row holding several values
+CSV_LIST_SEPARATOR = "|"
+
+
+def read_rows(file, format):
+    """
+    (line number, row) of a CSV or JSONL import file opened in binary mode.
+    In CSV, categories and images are separated by "|" and details is a
+    JSON list.
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    if format == "jsonl":
+        for number, line in enumerate(text, start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as exc:
+                    yield number, ValueError(f"Invalid JSON: {exc}")
+        return
+
+    reader = csv.DictReader(text)
+    for row in reader:
+        row = {name: value for name, value in row.items() if value not in ("", None)}
+        for name in ["categories", "images"]:
+            if name in row:
+                row[name] = row[name].split(CSV_LIST_SEPARATOR)
+        if "details" in row:
+            try:
+                row["details"] = json.loads(row["details"])
+            except ValueError as exc:
+                row = ValueError(f"Invalid details JSON: {exc}")
+        yield reader.line_num, row
+
+
+class CatalogImporter:
+    """
+    Create the products of an import file with bulk_create, one transaction
+    per chunk. Brands and categories are resolved and slugs are allocated
+    for the whole chunk at once instead of per row.
+    """
+
+    def __init__(self, chunk_size=1000, dry_run=False, progress=None):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.progress = progress
+        self.created = 0
+        self.errors = []
+
+        self.categories = dict(Category.objects.values_list("slug", "id"))
+        # The oldest brand wins when titles repeat
+        self.brands = dict(
+            Brand.objects.order_by("-created_at").values_list("title", "id")
+        )
+        self.slugs = set(
+            Product.objects.exclude(slug=None).values_list("slug", flat=True)
+        )
+
+    def run(self, rows):
+        rows = iter(rows)
+        while chunk := list(islice(rows, self.chunk_size)):
+            products = self.validate(chunk)
+            if products and not self.dry_run:
+                self.create(products)
+            if self.progress:
+                self.progress(self.created, len(self.errors))
+
+        if self.created:
+            invalidate_tags(
+                *[
+                    model_tag(model)
+                    for model in [Product, ProductImage, ProductDetail, Brand]
+                ]
+            )
+        return self.created, self.errors
+
+    def validate(self, chunk):
+        valid = []
+        for number, row in chunk:
+            if isinstance(row, Exception):
+                self.errors.append((number, str(row)))
+                continue
+
+            serializer = ProductImportSerializer(data=row)
+            if not serializer.is_valid():
+                self.errors.append((number, json.dumps(serializer.errors)))
+                continue
+
+            data = serializer.validated_data
+            unknown = [
+                slug for slug in data["categories"] if slug not in self.categories
+            ]
+            if unknown:
+                self.errors.append(
+                    (number, f"Unknown categories: {', '.join(unknown)}")
+                )
+                continue
+
+            if data.get("slug"):
+                if data["slug"] in self.slugs:
+                    self.errors.append((number, "This slug is already taken."))
+                    continue
+                self.slugs.add(data["slug"])
+            else:
+                data["slug"] = self.allocate_slug(data["title_en"])
+                if not data["slug"]:
+                    self.errors.append((number, "The title gives an empty slug."))
+                    continue
+            valid.append(data)
+        return valid
+
+    def allocate_slug(self, text):
+        """Slug of the title, suffixed until it is not taken by any product"""
+        base = slugify(text)
+        if not base:
+            return base
+        slug, counter = base, 2
+        while slug in self.slugs:
+            slug = f"{base}-{counter}"
+            counter += 1
+        self.slugs.add(slug)
+        return slug
+
+    @transaction.atomic
+    def create(self, rows):
+        new_brands = {row["brand"] for row in rows} - self.brands.keys()
+        brands = Brand.objects.bulk_create(
+            [Brand(title=title) for title in sorted(new_brands)]
+        )
+        for brand in brands:
+            self.brands[brand.title] = brand.id
+        update_suggest_terms(
+            Brand.objects.filter(pk__in=[brand.pk for brand in brands])
+        )
+
+        products, categories, details, images = [], [], [], []
+        for row in rows:
+            product = Product(
+                **{
+                    name: value
+                    for name, value in row.items()
+                    if name not in ["brand", "categories", "details", "images"]
+                },
+                brand_id_id=self.brands[row["brand"]],
+                # Product.save() is bypassed, no discount yet
+                effective_price=row["price"],
+            )
+            products.append(product)
+            categories += [
+                Product.categories.through(
+                    product_id=product.id, category_id=self.categories[slug]
+                )
+                for slug in dict.fromkeys(row["categories"])
+            ]
+            details += [
+                ProductDetail(product_id=product, **detail) for detail in row["details"]
+            ]
+            images += [
+                ProductImage(product_id=product, image=image, order=order)
+                for order, image in enumerate(row["images"])
+            ]
+
+        Product.objects.bulk_create(products)
+        Product.categories.through.objects.bulk_create(categories)
+        ProductDetail.objects.bulk_create(details)
+        ProductImage.objects.bulk_create(images)
+
+        # bulk_create sends no signals, maintain what products.signals would
+        StoredFile.objects.acquire(image.image.name for image in images)
+        ImageJob.objects.queue(images, "image")
+        created = Product.objects.filter(pk__in=[product.pk for product in products])
+        update_search_vectors(created)
+        update_suggest_terms(created)
+        refresh_effective_prices(created)
+        self.created += len(products)
@@ -0,0 +1,229 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from products.models import Brand, Category, Product, ProductDiscount
+from products.pricing import refresh_effective_prices
+from products.search import update_search_vectors, update_suggest_terms
+
+# Title words per language, products are named by combining them
+WORDS = {
+    "en": (
+        "wireless headphones smart watch gaming laptop phone charger speaker "
+        "portable keyboard mouse monitor camera tablet bluetooth earbuds router "
+        "printer case"
+    ).split(),
+    "ru": (
+        "беспроводные наушники умные часы игровой ноутбук телефон зарядка "
+        "колонка портативная клавиатура мышь монитор камера планшет чехол "
+        "роутер принтер"
+    ).split(),
+    "uz": (
+        "simsiz quloqchin aqlli soat noutbuk telefon zaryadlovchi karnay "
+        "klaviatura sichqoncha monitor kamera planshet g'ilof printer"
+    ).split(),
+}
+BRANDS = (
+    "Samsung Apple Xiaomi Sony Lenovo Huawei Asus Acer Logitech Philips Anker "
+    "Realme Honor Dell Canon"
+).split()
+ENDPOINTS = ["suggest", "list", "facets"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time catalog endpoints against a seeded catalog in a throwaway test "
+        "database and report latency percentiles"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=200_000)
+        parser.add_argument(
+            "--requests", type=int, default=500, help="Timed requests per endpoint"
+        )
+        parser.add_argument(
+            "--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Keep the seeded test database for the next run",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        # Not serialized, that alone takes minutes on a seeded catalog
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options["keepdb"], serialize=False
+        )
+        try:
+            if Product.objects.count() != options["products"]:
+                self.seed(options["products"])
+            for endpoint in options["endpoints"]:
+                # list and facets time the same pages
+                self.random.seed(options["seed"])
+                urls = getattr(self, f"get_{endpoint}_urls")(options["requests"])
+                self.report(endpoint, self.time_requests(urls))
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options["keepdb"]
+            )
+
+    def seed(self, count):
+        started = time.perf_counter()
+        Product.objects.all().delete()
+        Brand.objects.all().delete()
+        Category.objects.all().delete()
+
+        brands = Brand.objects.bulk_create(
+            [Brand(title=f"{title} {index}") for index in range(4) for title in BRANDS]
+        )
+        categories = []
+        for index in range(20):
+            titles = self.make_titles(1)
+            root = Category.objects.create(
+                title_ru=f"{titles['ru']} {index}",
+                title_en=f"{titles['en']} {index}",
+                title_uz=f"{titles['uz']} {index}",
+            )
+            for child in range(5):
+                titles = self.make_titles(2)
+                categories.append(
+                    Category.objects.create(
+                        parent=root,
+                        title_ru=f"{titles['ru']} {child}",
+                        title_en=f"{titles['en']} {child}",
+                        title_uz=f"{titles['uz']} {child}",
+                    )
+                )
+
+        now = timezone.now()
+        through = Product.categories.through
+        for start in range(0, count, 5000):
+            products, links, discounts = [], [], []
+            for index in range(start, min(start + 5000, count)):
+                titles = self.make_titles(3)
+                price = Decimal(self.random.randrange(1_000, 10_000_000)) / 100
+                product = Product(
+                    title_ru=titles["ru"],
+                    title_en=titles["en"],
+                    title_uz=titles["uz"],
+                    slug=f"product-{index}",
+                    short_description_ru=titles["ru"],
+                    description_ru=titles["ru"],
+                    price=price,
+                    effective_price=price,
+                    is_in_stock=self.random.random() < 0.8,
+                    is_pre_order=self.random.random() < 0.05,
+                    brand_id=self.random.choice(brands),
+                )
+                products.append(product)
+                links += [
+                    through(product_id=product.pk, category_id=category.pk)
+                    for category in self.random.sample(categories, 2)
+                ]
+                if self.random.random() < 0.2:
+                    discounts.append(
+                        ProductDiscount(
+                            product=product,
+                            percent=self.random.randrange(5, 50),
+                            start_date=now - timedelta(days=1),
+                            end_date=now + timedelta(days=7),
+                        )
+                    )
+            Product.objects.bulk_create(products)
+            through.objects.bulk_create(links)
+            ProductDiscount.objects.bulk_create(discounts)
+            self.stderr.write(f"{start + len(products)} products seeded")
+
+        update_search_vectors(Product.objects.all())
+        update_suggest_terms(Product.objects.all())
+        # Created without signals
+        update_suggest_terms(Brand.objects.all())
+        refresh_effective_prices(Product.objects.all())
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.stderr.write(f"Seeded in {time.perf_counter() - started:.0f} s")
+
+    def make_titles(self, length):
+        return {
+            lang: " ".join(self.random.choices(words, k=length)).capitalize()
+            + f" {self.random.randrange(100, 1000)}"
+            for lang, words in WORDS.items()
+        }
+
+    def get_suggest_urls(self, count):
+        """Prefixes and misspellings of title and brand words"""
+        words = [word for words in WORDS.values() for word in words] + BRANDS
+        urls = []
+        for _ in range(count):
+            word = self.random.choice(words).lower()
+            if self.random.random() < 0.5:
+                word = word[: self.random.randrange(3, max(len(word), 4))]
+            else:
+                typo = self.random.randrange(len(word))
+                word = word[:typo] + word[typo + 1 :]
+            urls.append(f"{reverse('product_suggest')}?q={word}")
+        return urls
+
+    def get_list_urls(self, count, facets=False):
+        """Product list pages, unfiltered or filtered like the storefront"""
+        slugs = list(Category.objects.values_list("slug", flat=True))
+        brands = list(Brand.objects.values_list("title", flat=True))
+        urls = []
+        for _ in range(count):
+            params = self.random.choice(
+                [
+                    {},
+                    {"slug": self.random.choice(slugs)},
+                    {"brand": self.random.choice(brands)},
+                    {"q": self.random.choice(WORDS["en"] + WORDS["ru"])},
+                    {"min_price": 100, "max_price": self.random.randrange(200, 5000)},
+                ]
+            )
+            if facets:
+                params["facets"] = "brand,category,price,stock"
+            urls.append(f"{reverse('product_list')}?{urlencode(params)}")
+        return urls
+
+    def get_facets_urls(self, count):
+        """The same pages as list, with every facet"""
+        return self.get_list_urls(count, facets=True)
+
+    def time_requests(self, urls):
+        """Seconds of every request, the response cache cleared before each"""
+        client = Client()
+        for url in urls[:10]:
+            client.get(url)
+
+        timings = []
+        for url in urls:
+            cache.clear()
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200, (url, response.status_code)
+        return timings
+
+    def report(self, endpoint, timings):
+        percentiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f"{endpoint}: {len(timings)} requests, "
+            f"p50 {percentiles[49] * 1000:.1f} ms, "
+            f"p99 {percentiles[98] * 1000:.1f} ms, "
+            f"max {max(timings) * 1000:.1f} ms"
+        )
@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.utils import translation
+
+from products.export import FEEDS, iter_feed
+
+
+class Command(BaseCommand):
+    help = "Write the whole catalog as a CSV, JSONL or XML feed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--feed", choices=list(FEEDS), default="csv")
+        parser.add_argument(
+            "--output", help="File to write, replaced atomically. Default: stdout"
+        )
+        parser.add_argument("--lang", choices=["uz", "ru", "en"], default="uz")
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        with translation.override(options["lang"]):
+            lines = iter_feed(options["feed"], chunk_size=options["chunk_size"])
+            output = options["output"]
+            if not output:
+                for line in lines:
+                    self.stdout.write(line, ending="")
+                return
+
+            # Readers of the feed never see a partially written file
+            directory = os.path.dirname(os.path.abspath(output))
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", newline="", dir=directory, delete=False
+            ) as file:
+                try:
+                    file.writelines(lines)
+                except BaseException:
+                    os.unlink(file.name)
+                    raise
+            os.chmod(file.name, 0o644)
+            os.replace(file.name, output)
+            self.stderr.write(f"Wrote {output}")
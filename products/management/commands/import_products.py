@@ -0,0 +1,39 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import FORMATS, CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create products from a CSV or JSONL file in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file")
+        parser.add_argument(
+            "--format", choices=FORMATS, help="Default: the file extension"
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only validate the rows"
+        )
+
+    def handle(self, *args, **options):
+        format = options["format"] or os.path.splitext(options["file"])[1][1:].lower()
+        if format not in FORMATS:
+            raise CommandError("Unknown format, pass --format csv or jsonl")
+
+        def progress(created, failed):
+            self.stderr.write(f"{created} created, {failed} rejected")
+
+        importer = CatalogImporter(
+            chunk_size=options["chunk_size"],
+            dry_run=options["dry_run"],
+            progress=progress,
+        )
+        with open(options["file"], "rb") as file:
+            created, errors = importer.run(read_rows(file, format))
+
+        for number, error in errors:
+            self.stderr.write(f"Line {number}: {error}")
+        self.stdout.write(f"Created {created} products, rejected {len(errors)} rows")
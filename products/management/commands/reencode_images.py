@@ -0,0 +1,173 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from common.images import write_model_images
+from common.models import File, StoredFile
+from products.models import CATEGORY_TREE_TAG, ProductImage, product_tag
+from utils.cache import invalidate_tags, model_tag
+
+# Model label: (model, file field)
+TARGETS = {
+    "products.productimage": (ProductImage, "image"),
+    "common.file": (File, "file"),
+}
+
+
+def get_available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        # Honors the CPU set of containers
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert the stored images to WebP and generate their variants in a "
+        "process pool, resuming from the last checkpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--models", nargs="+", choices=list(TARGETS), default=list(TARGETS)
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-encode every image, not only those without WebP or variants",
+        )
+        parser.add_argument("--workers", type=int, default=get_available_cores())
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--checkpoint",
+            default=os.path.join(settings.MEDIA_ROOT, ".reencode-checkpoint.json"),
+            help="File recording the last processed row of every model",
+        )
+        parser.add_argument(
+            "--restart", action="store_true", help="Ignore the checkpoint"
+        )
+
+    def handle(self, *args, **options):
+        self.checkpoint_path = options["checkpoint"]
+        self.checkpoint = {} if options["restart"] else self.read_checkpoint()
+
+        with ProcessPoolExecutor(
+            max_workers=options["workers"], initializer=django.setup
+        ) as pool:
+            for label in options["models"]:
+                self.reencode(pool, label, options["force"], options["batch_size"])
+
+    def reencode(self, pool, label, force, batch_size):
+        model, field_name = TARGETS[label]
+        queryset = model.objects.order_by("pk")
+        if not force:
+            queryset = queryset.filter(
+                ~Q(**{f"{field_name}__iendswith": ".webp"}) | Q(variants={})
+            ).exclude(**{field_name: ""})
+
+        done = 0
+        while True:
+            last = self.checkpoint.get(label)
+            batch = queryset.filter(pk__gt=last) if last else queryset
+            rows = list(batch.values_list("pk", field_name, "variants")[:batch_size])
+            if not rows:
+                # Finished, the next run starts over
+                self.checkpoint.pop(label, None)
+                self.write_checkpoint()
+                break
+
+            # Workers are forked on the first map() and query the database
+            # too, they must not share the connections of this process
+            connections.close_all()
+            results = pool.map(
+                write_model_images,
+                *zip(*[(label, field_name, source, force) for _, source, _ in rows]),
+            )
+            updated = self.swap(model, field_name, rows, results)
+            if updated:
+                self.invalidate(model, updated)
+
+            self.checkpoint[label] = str(rows[-1][0])
+            self.write_checkpoint()
+            done += len(rows)
+            self.stdout.write(f"{label}: {done} processed, {len(updated)} updated")
+
+    def swap(self, model, field_name, rows, results):
+        """
+        Store the new names of a batch in one transaction. Rows given
+        another file by live traffic in the meantime are left alone and the
+        files written for them are discarded, as are rows whose new files
+        were discarded before they could be referenced.
+        """
+        storage = model._meta.get_field(field_name).storage
+        now = timezone.now()
+        swaps, updated, unused, released = [], [], [], []
+        with transaction.atomic():
+            instances = model.objects.select_for_update().in_bulk(
+                [pk for pk, _, _ in rows]
+            )
+            for (pk, source, variants), (name, names, error) in zip(rows, results):
+                if error:
+                    self.stderr.write(f"{source}: {error}")
+                    continue
+                instance = instances.get(pk)
+                if instance is None or getattr(instance, field_name).name != source:
+                    unused += set(names.values()) - {source}
+                    continue
+                previous = {source, *variants.values()}
+                swaps.append((instance, name, names, previous))
+
+            # Referenced first, so that they can no longer be discarded
+            StoredFile.objects.acquire(
+                new_name
+                for _, _, names, previous in swaps
+                for new_name in set(names.values()) - previous
+            )
+            for instance, name, names, previous in swaps:
+                added = set(names.values()) - previous
+                missing = [new for new in added if not storage.exists(new)]
+                if missing:
+                    self.stderr.write(f"{instance.pk}: discarded meanwhile {missing}")
+                    StoredFile.objects.release(added)
+                    continue
+                setattr(instance, field_name, name)
+                instance.variants = names
+                instance.updated_at = now
+                updated.append(instance)
+                released += previous - set(names.values())
+
+            # bulk_update() sends no signals, see invalidate() and
+            # common.signals.track_references()
+            model.objects.bulk_update(updated, [field_name, "variants", "updated_at"])
+            StoredFile.objects.release(released)
+        StoredFile.objects.discard(unused)
+        return updated
+
+    def invalidate(self, model, updated):
+        tags = [model_tag(model)]
+        if model is ProductImage:
+            tags += [product_tag(image.product_id_id) for image in updated]
+        else:
+            tags.append(CATEGORY_TREE_TAG)
+        invalidate_tags(*dict.fromkeys(tags))
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def write_checkpoint(self):
+        # Replaced atomically, an interrupted run keeps the previous one
+        temporary = f"{self.checkpoint_path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(self.checkpoint, file)
+        os.replace(temporary, self.checkpoint_path)
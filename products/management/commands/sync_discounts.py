@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.models import Product, product_tag
+from products.pricing import get_next_discount_change, refresh_effective_prices
+from utils.cache import invalidate_tags, model_tag
+
+
+class Command(BaseCommand):
+    help = "Keep Product.effective_price in sync with the discount windows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Synchronize once and exit"
+        )
+        parser.add_argument(
+            "--max-sleep",
+            type=float,
+            default=60,
+            help="Upper bound in seconds between two runs, picks up new discounts",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            now = timezone.now()
+            changed = refresh_effective_prices(Product.objects.all(), now)
+            if changed:
+                # Set-based UPDATEs do not send post_save
+                invalidate_tags(model_tag(Product), *map(product_tag, changed))
+                self.stdout.write(f"{now.isoformat()} updated {len(changed)} products")
+
+            if options["once"]:
+                return
+
+            time.sleep(self.get_sleep(options["max_sleep"]))
+
+    def get_sleep(self, max_sleep):
+        """Seconds until the next discount window starts or ends"""
+        now = timezone.now()
+        next_change = get_next_discount_change(now)
+        if next_change is None:
+            return max_sleep
+
+        # A window is active up to and including its end date
+        seconds = (next_change - now).total_seconds() + 0.001
+        return min(max(seconds, 0), max_sleep)
@@ -0,0 +1,57 @@
+# Generated by Django 5.2 on 2026-10-18 11:30
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+# Text search configuration per language when this migration was written
+SEARCH_CONFIGS = {"uz": "simple", "ru": "russian", "en": "english"}
+
+
+def populate_search_vectors(apps, schema_editor):
+    """products.search.update_search_vectors() as of this migration"""
+    Product = apps.get_model("products", "Product")
+    ProductDetail = apps.get_model("products", "ProductDetail")
+    vector = None
+    for lang, config in SEARCH_CONFIGS.items():
+        details = (
+            ProductDetail.objects.filter(product_id=OuterRef("pk"))
+            .order_by()
+            .values("product_id")
+            .annotate(text=StringAgg(f"value_{lang}", delimiter=" "))
+            .values("text")
+        )
+        language_vector = (
+            SearchVector(f"title_{lang}", weight="A", config=config)
+            + SearchVector(f"short_description_{lang}", weight="B", config=config)
+            + SearchVector(Subquery(details), weight="C", config=config)
+        )
+        vector = language_vector if vector is None else vector + language_vector
+    Product.objects.update(search_vector=vector)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0002_product_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="products_pr_search__98d711_gin"
+            ),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+    ]
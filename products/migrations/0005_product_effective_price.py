@@ -0,0 +1,65 @@
+# Generated by Django 5.2 on 2026-10-18 11:35
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.functions import Now, Round
+
+
+def populate_effective_prices(apps, schema_editor):
+    """products.pricing.refresh_effective_prices() as of this migration"""
+    Product = apps.get_model("products", "Product")
+    ProductDiscount = apps.get_model("products", "ProductDiscount")
+    Product.objects.update(effective_price=models.F("price"))
+
+    percent = ProductDiscount.objects.filter(product=models.OuterRef("pk")).values(
+        "percent"
+    )
+    Product.objects.filter(
+        discount__start_date__lte=Now(), discount__end_date__gte=Now()
+    ).update(
+        effective_price=Round(
+            models.ExpressionWrapper(
+                models.F("price")
+                - models.F("price") * models.Subquery(percent) / Decimal(100),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            ),
+            2,
+        ),
+        discount_active=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0004_trigram_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="discount_active",
+            field=models.BooleanField(
+                default=False, editable=False, verbose_name="Discount active"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="effective_price",
+            field=models.DecimalField(
+                decimal_places=2,
+                default=0,
+                editable=False,
+                max_digits=10,
+                verbose_name="Effective price",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["effective_price", "id"], name="products_pr_effecti_5873d8_idx"
+            ),
+        ),
+        migrations.RunPython(populate_effective_prices, migrations.RunPython.noop),
+    ]
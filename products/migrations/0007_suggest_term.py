@@ -0,0 +1,115 @@
+# Generated by Django 5.2 on 2026-10-18 13:42
+
+import re
+import uuid
+from itertools import islice
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+# Translated title columns and term pattern when this migration was written
+TITLE_FIELDS = ["title_uz", "title_ru", "title_en"]
+TERM_RE = re.compile(r"[^\W_]{2,}")
+
+
+def populate_suggest_terms(apps, schema_editor):
+    """products.search.update_suggest_terms() as of this migration"""
+    SuggestTerm = apps.get_model("products", "SuggestTerm")
+    for relation, model_name, fields in [
+        ("products", "Product", TITLE_FIELDS),
+        ("brands", "Brand", ["title"]),
+        ("categories", "Category", TITLE_FIELDS),
+    ]:
+        through = getattr(SuggestTerm, relation).through
+        column = f"{model_name.lower()}_id"
+        model = apps.get_model("products", model_name)
+        rows = model.objects.values_list("pk", *fields).iterator(5000)
+        while batch := list(islice(rows, 5000)):
+            terms = {
+                pk: {
+                    term
+                    for title in titles
+                    for term in TERM_RE.findall((title or "").lower())
+                    if len(term) <= 100
+                }
+                for pk, *titles in batch
+            }
+            names = set().union(*terms.values())
+            SuggestTerm.objects.bulk_create(
+                [SuggestTerm(term=name) for name in names], ignore_conflicts=True
+            )
+            ids = dict(
+                SuggestTerm.objects.filter(term__in=names).values_list("term", "pk")
+            )
+            through.objects.bulk_create(
+                through(suggestterm_id=ids[name], **{column: pk})
+                for pk, row_terms in terms.items()
+                for name in row_terms
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0006_productimage_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SuggestTerm",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Created at"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Updated at"),
+                ),
+                (
+                    "term",
+                    models.CharField(max_length=100, unique=True, verbose_name="Term"),
+                ),
+                (
+                    "brands",
+                    models.ManyToManyField(
+                        related_name="suggest_terms", to="products.brand"
+                    ),
+                ),
+                (
+                    "categories",
+                    models.ManyToManyField(
+                        related_name="suggest_terms", to="products.category"
+                    ),
+                ),
+                (
+                    "products",
+                    models.ManyToManyField(
+                        related_name="suggest_terms", to="products.product"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Suggest Term",
+                "verbose_name_plural": "Suggest Terms",
+                "indexes": [
+                    django.contrib.postgres.indexes.GistIndex(
+                        fields=["term"],
+                        name="suggest_term_trgm",
+                        opclasses=["gist_trgm_ops"],
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_suggest_terms, migrations.RunPython.noop),
+    ]
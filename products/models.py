@@ -1,28 +1,46 @@
-import os
 import uuid
 from decimal import Decimal
 
-from PIL import Image
-from io import BytesIO
-
-from django.db import models
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import JSONObject
 from django.utils.text import slugify
-from django.core.files.base import ContentFile
 from django.utils import timezone
+from django.utils.translation import get_language
 from django.core.exceptions import ValidationError
+from modeltranslation.translator import translator
+from modeltranslation.utils import build_localized_fieldname, resolution_order
 from mptt.models import MPTTModel, TreeForeignKey
 
 from core import settings
-from common.models import File
+from common.models import File, ImageJob
 from utils.base import BaseModel
 
 
 # Create your models here.
 
+# Cache tag of the serialized category tree, see products.signals
+CATEGORY_TREE_TAG = "category-tree"
+
+
+def product_tag(product_id):
+    """Tag of the cache entries built from a single product"""
+    return f"product:{product_id}"
+
 
 class Brand(BaseModel):
     title = models.CharField(max_length=225, verbose_name="Title")
 
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=["title"], opclasses=["gin_trgm_ops"], name="brand_title_trgm"
+            ),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -65,6 +83,14 @@ class Category(MPTTModel):
     class Meta:
         verbose_name = "Category"
         verbose_name_plural = "Categories"
+        indexes = [
+            GinIndex(
+                fields=[f"title_{lang}"],
+                opclasses=["gin_trgm_ops"],
+                name=f"category_title_{lang}_trgm",
+            )
+            for lang in ["uz", "ru", "en"]
+        ]
 
     class MPTTMeta:
         order_insertion_by = ["title"]
@@ -73,6 +99,66 @@ class Category(MPTTModel):
         return str(self.title)
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_cover_image(self):
+        """
+        Annotate the name and the variants of the first image as cover_image
+        and cover_variants.
+        """
+        images = ProductImage.objects.filter(product_id=OuterRef("pk")).order_by(
+            "order"
+        )
+        return self.annotate(
+            cover_image=Subquery(images.values("image")[:1]),
+            cover_variants=Subquery(images.values("variants")[:1]),
+        )
+
+    def for_listing(self, fields=None):
+        """
+        Load the discount and the cover image together with the products,
+        or only those of them named in fields.
+        """
+        queryset = self
+        if fields is None or "discount" in fields:
+            queryset = queryset.select_related("discount")
+        if fields is None or "image" in fields:
+            queryset = queryset.with_cover_image()
+        return queryset
+
+    def localized(self, *large_fields):
+        """
+        Only load the translation columns of the active language and its
+        fallbacks, large_fields are not loaded at all. Call it per request,
+        the language is read when the queryset is built.
+        """
+        languages = resolution_order(get_language())
+        translated = translator.get_options_for_model(self.model).fields
+        deferred = [
+            build_localized_fieldname(field, lang)
+            for field in translated
+            if field not in large_fields
+            for lang, _ in settings.LANGUAGES
+            if lang not in languages
+        ]
+        return self.defer(*deferred, *large_fields)
+
+    def for_detail(self):
+        """
+        Load the discount, the images and the details in two queries, the
+        images are aggregated into an image_rows array on the product.
+        """
+        images = (
+            ProductImage.objects.filter(product_id=OuterRef("pk"))
+            .order_by("order")
+            .values(row=JSONObject(id="id", image="image", variants="variants"))
+        )
+        return (
+            self.select_related("discount")
+            .prefetch_related("product_details")
+            .annotate(image_rows=ArraySubquery(images))
+        )
+
+
 class Product(BaseModel):
     title = models.CharField(max_length=255, verbose_name="Title")
     slug = models.SlugField(unique=True, blank=True, null=True)
@@ -85,10 +171,39 @@ class Product(BaseModel):
     is_pre_order = models.BooleanField(default=False, verbose_name="Pre order")
     brand_id = models.ForeignKey(Brand, verbose_name="Brand", on_delete=models.PROTECT)
     categories = models.ManyToManyField(Category, related_name="products")
+    # Maintained by products.signals, see products.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Price after the active discount, see products.pricing
+    effective_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        verbose_name="Effective price",
+    )
+    discount_active = models.BooleanField(
+        default=False, editable=False, verbose_name="Discount active"
+    )
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Product"
         verbose_name_plural = "Products"
+        indexes = [
+            # Keyset pagination sort keys, see products.pagination
+            models.Index(fields=["created_at", "id"]),
+            models.Index(fields=["price", "id"]),
+            models.Index(fields=["effective_price", "id"]),
+            GinIndex(fields=["search_vector"]),
+        ] + [
+            GinIndex(
+                fields=[f"title_{lang}"],
+                opclasses=["gin_trgm_ops"],
+                name=f"product_title_{lang}_trgm",
+            )
+            for lang in ["uz", "ru", "en"]
+        ]
 
     def clean(self):
         # Ensure slug is generated before validation
@@ -102,6 +217,10 @@ class Product(BaseModel):
         if not self.slug:
             self.slug = slugify(self.title_en)
 
+        # Discounted prices are refreshed by products.signals
+        if not self.discount_active:
+            self.effective_price = self.price
+
         self.full_clean()
 
         super().save(*args, **kwargs)
@@ -110,6 +229,36 @@ class Product(BaseModel):
         return str(self.title)
 
 
+class SuggestTerm(BaseModel):
+    """
+    A distinct word of the product, brand and category titles, in any
+    language, linked to the rows using it. Autocomplete matches the typed
+    words against these few terms instead of every title, see
+    products.search.suggest().
+    """
+
+    term = models.CharField(max_length=100, unique=True, verbose_name="Term")
+    # Maintained by products.signals, see products.search
+    products = models.ManyToManyField(Product, related_name="suggest_terms")
+    brands = models.ManyToManyField(Brand, related_name="suggest_terms")
+    categories = models.ManyToManyField(Category, related_name="suggest_terms")
+
+    class Meta:
+        verbose_name = "Suggest Term"
+        verbose_name_plural = "Suggest Terms"
+        indexes = [
+            # Nearest terms first with ORDER BY text <<-> term LIMIT n
+            GistIndex(
+                fields=["term"],
+                opclasses=["gist_trgm_ops"],
+                name="suggest_term_trgm",
+            ),
+        ]
+
+    def __str__(self):
+        return self.term
+
+
 class ProductDetail(BaseModel):
     product_id = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name="product_details"
@@ -161,6 +310,10 @@ class ProductImage(BaseModel):
         Product, on_delete=models.CASCADE, related_name="product_images"
     )
     image = models.ImageField(upload_to="uploads/products/files")
+    # Width: name of the downsized copies, see common.images
+    variants = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Variants"
+    )
     order = models.PositiveIntegerField(
         default=0, verbose_name="Order", null=False, blank=False
     )
@@ -171,29 +324,16 @@ class ProductImage(BaseModel):
         ordering = ["order"]
 
     def save(self, *args, **kwargs):
-        is_webp = self.image.name.lower().endswith(".webp")
-        original_path = None
-
-        if not is_webp and self.image:
-            original_path = os.path.join(
-                settings.MEDIA_ROOT + "/uploads/products/files", self.image.name
-            )
-        super().save(*args, **kwargs)
-
-        if not is_webp:
-            image = Image.open(self.image)
-            image = image.convert("RGBA")
-
-            webp_io = BytesIO()
-            image.save(webp_io, format("WEBP"), quality=80)
-
-            webp_path = os.path.splitext(os.path.basename(self.image.name))[0] + ".webp"
-            self.image.save(webp_path, ContentFile(webp_io.getvalue()), save=False)
+        uploaded = not self.image._committed
+        if uploaded:
+            # A new upload, the variants of the previous one do not apply
+            self.variants = {}
+        # The stored file stays reserved until its reference is counted
+        with transaction.atomic():
             super().save(*args, **kwargs)
-
-            # Deleting original image
-            if original_path and os.path.exists(original_path):
-                os.remove(original_path)
+            # The original is served until the process_image_jobs worker
+            # swaps in the WebP version and its variants
+            ImageJob.objects.queue([self], "image", uploaded)
 
     def __str__(self):
         return f"Image for {self.product_id} | Order: {self.order}"
@@ -0,0 +1,191 @@
+import json
+import uuid
+import base64
+import binascii
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import BooleanField, CharField, F, Func, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import translation
+from django.utils.dateparse import parse_datetime
+from modeltranslation.utils import build_localized_fieldname, resolution_order
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class RowComparison(Func):
+    """
+    (a, b) < (c, d) or >, compared as rows. Unlike the equivalent
+    a < c OR (a = c AND b < d), PostgreSQL turns it into an index range
+    condition on (a, b).
+    """
+
+    output_field = BooleanField()
+
+    def __init__(self, left, operator, right):
+        self.operator = operator
+        super().__init__(*left, *right)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sqls, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            sqls.append(sql)
+            params.extend(expression_params)
+        half = len(sqls) // 2
+        left, right = ", ".join(sqls[:half]), ", ".join(sqls[half:])
+        return f"({left}) {self.operator} ({right})", params
+
+
+class ProductCursorPagination(BasePagination):
+    """
+    Keyset pagination over (sort key, id).
+
+    Each page is fetched with a WHERE on the last seen key instead of an
+    OFFSET, and no COUNT is issued, so page N costs the same as page 1.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    ordering_fields = ("created_at", "price", "effective_price", "title")
+    default_ordering = "-created_at"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor["reverse"]
+
+        # Walking backwards means scanning in the opposite direction
+        descending = self.ordering.startswith("-") != reverse
+        queryset = queryset.annotate(cursor_key=self.get_sort_expression())
+        if descending:
+            queryset = queryset.order_by("-cursor_key", "-id")
+        else:
+            queryset = queryset.order_by("cursor_key", "id")
+
+        if cursor is not None:
+            queryset = queryset.filter(
+                RowComparison(
+                    [F("cursor_key"), F("id")],
+                    "<" if descending else ">",
+                    [Value(cursor["key"]), Value(cursor["id"])],
+                )
+            )
+
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(
+            self.ordering_query_param, self.default_ordering
+        )
+        if ordering.lstrip("-") not in self.ordering_fields:
+            return self.default_ordering
+        return ordering
+
+    def get_sort_expression(self):
+        field = self.ordering.lstrip("-")
+        if field == "title":
+            # Sort by the title the client actually sees, fallbacks included.
+            # modeltranslation falls back past "" as well as NULL
+            languages = resolution_order(translation.get_language())
+            return Coalesce(
+                *[
+                    NullIf(F(build_localized_fieldname(field, lang)), Value(""))
+                    for lang in languages
+                ],
+                Value(""),
+                output_field=CharField(),
+            )
+        return F(field)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, obj, reverse):
+        # Model instances or values() rows
+        if isinstance(obj, dict):
+            key, pk = obj["cursor_key"], obj["id"]
+        else:
+            key, pk = obj.cursor_key, obj.pk
+        payload = {
+            "o": self.ordering,
+            "k": key.isoformat() if hasattr(key, "isoformat") else str(key),
+            "i": str(pk),
+            "r": reverse,
+        }
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(payload, separators=(",", ":")).encode()
+        ).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if payload["o"] != self.ordering:
+                raise ValueError
+            return {
+                "key": self.parse_key(payload["k"]),
+                "id": uuid.UUID(payload["i"]),
+                "reverse": bool(payload["r"]),
+            }
+        except (TypeError, ValueError, KeyError, InvalidOperation, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def parse_key(self, value):
+        field = self.ordering.lstrip("-")
+        if field == "created_at":
+            key = parse_datetime(value)
+            if key is None:
+                raise ValueError
+            return key
+        if field in ["price", "effective_price"]:
+            return Decimal(value)
+        return value
@@ -0,0 +1,68 @@
+from decimal import Decimal
+
+from django.db.models import (
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+)
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from .models import ProductDiscount
+
+
+def refresh_effective_prices(queryset, now=None):
+    """
+    Store the price after the active discount, if any, on the products
+    with two set-based UPDATEs. Returns the ids of the products changed.
+    """
+    now = now or timezone.now()
+    discount_model = queryset.model._meta.get_field("discount").related_model
+    active = Q(discount__start_date__lte=now, discount__end_date__gte=now)
+    percent = discount_model.objects.filter(product=OuterRef("pk")).values("percent")
+    discounted_price = Round(
+        ExpressionWrapper(
+            F("price") - F("price") * Subquery(percent) / Decimal(100),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        2,
+    )
+
+    activated = list(
+        queryset.filter(active)
+        .alias(discounted_price=discounted_price)
+        .exclude(discount_active=True, effective_price=F("discounted_price"))
+        .values_list("pk", flat=True)
+    )
+    deactivated = list(
+        queryset.exclude(active)
+        .exclude(discount_active=False, effective_price=F("price"))
+        .values_list("pk", flat=True)
+    )
+    # Only the stale rows are written, their ids let callers expire caches
+    if activated:
+        queryset.model.objects.filter(pk__in=activated).update(
+            effective_price=discounted_price, discount_active=True
+        )
+    if deactivated:
+        queryset.model.objects.filter(pk__in=deactivated).update(
+            effective_price=F("price"), discount_active=False
+        )
+    return activated + deactivated
+
+
+def get_next_discount_change(now=None):
+    """Closest future moment at which a discount window starts or ends"""
+    now = now or timezone.now()
+    boundaries = ProductDiscount.objects.aggregate(
+        next_start=Min("start_date", filter=Q(start_date__gt=now)),
+        next_end=Min("end_date", filter=Q(end_date__gte=now)),
+    )
+    return min(
+        (moment for moment in boundaries.values() if moment is not None),
+        default=None,
+    )
@@ -0,0 +1,229 @@
+import re
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordDistance,
+)
+from django.db.models import Exists, F, OuterRef, Subquery
+from modeltranslation.utils import build_localized_fieldname
+
+from .models import Brand, Category, Product, SuggestTerm
+
+# Words as pg_trgm splits them, single characters are not worth suggesting
+TERM_RE = re.compile(r"[^\W_]{2,}")
+# Nearest terms of the word being typed that suggestions are taken from
+SUGGEST_TERMS = 10
+
+
+def get_search_configs():
+    """PostgreSQL text search configuration for every language in LANGUAGES"""
+    return {
+        lang: settings.SEARCH_CONFIGS.get(lang, "simple")
+        for lang, _ in settings.LANGUAGES
+    }
+
+
+def build_search_vector(model):
+    """
+    Weighted tsvector over every translation of the product title (A),
+    short description (B) and detail values (C).
+    """
+    detail_model = model._meta.get_field("product_details").related_model
+    vector = None
+    for lang, config in get_search_configs().items():
+        details = (
+            detail_model.objects.filter(product_id=OuterRef("pk"))
+            .order_by()
+            .values("product_id")
+            .annotate(
+                text=StringAgg(build_localized_fieldname("value", lang), delimiter=" ")
+            )
+            .values("text")
+        )
+        language_vector = (
+            SearchVector(
+                build_localized_fieldname("title", lang), weight="A", config=config
+            )
+            + SearchVector(
+                build_localized_fieldname("short_description", lang),
+                weight="B",
+                config=config,
+            )
+            + SearchVector(Subquery(details), weight="C", config=config)
+        )
+        vector = language_vector if vector is None else vector + language_vector
+    return vector
+
+
+def update_search_vectors(queryset):
+    """Rebuild the stored search vector of the products in one UPDATE"""
+    return queryset.update(search_vector=build_search_vector(queryset.model))
+
+
+def search_products(queryset, text):
+    """Filter the products matching text in any language, best matches first"""
+    query = None
+    for config in set(get_search_configs().values()):
+        language_query = SearchQuery(text, config=config, search_type="websearch")
+        query = language_query if query is None else query | language_query
+
+    return (
+        queryset.annotate(search_rank=SearchRank(F("search_vector"), query))
+        .filter(search_vector=query)
+        .order_by("-search_rank", "id")
+    )
+
+
+def get_title_fields(model):
+    """The title column of every language, or the one of untranslated models"""
+    fields = [
+        build_localized_fieldname("title", lang) for lang, _ in settings.LANGUAGES
+    ]
+    names = {field.name for field in model._meta.get_fields()}
+    return [field for field in fields if field in names] or ["title"]
+
+
+def get_terms(text):
+    """Distinct lowercase words of text that can be suggestion terms"""
+    max_length = SuggestTerm._meta.get_field("term").max_length
+    return {
+        term
+        for term in TERM_RE.findall((text or "").lower())
+        if len(term) <= max_length
+    }
+
+
+def get_term_links(model):
+    """The table linking terms to rows of model, and its column of the row"""
+    through = model.suggest_terms.through
+    return through, through._meta.get_field(model._meta.model_name).attname
+
+
+def update_suggest_terms(queryset, batch_size=5000):
+    """
+    Link the products, brands or categories to the terms of their titles
+    in every language. Terms nothing uses anymore are kept, suggest()
+    skips them.
+    """
+    through, column = get_term_links(queryset.model)
+    fields = get_title_fields(queryset.model)
+    rows = queryset.values_list("pk", *fields).iterator(batch_size)
+    while batch := list(islice(rows, batch_size)):
+        terms = {pk: set().union(*map(get_terms, titles)) for pk, *titles in batch}
+        names = set().union(*terms.values())
+        SuggestTerm.objects.bulk_create(
+            [SuggestTerm(term=name) for name in names], ignore_conflicts=True
+        )
+        ids = dict(SuggestTerm.objects.filter(term__in=names).values_list("term", "pk"))
+        through.objects.filter(**{f"{column}__in": terms}).delete()
+        through.objects.bulk_create(
+            through(suggestterm_id=ids[name], **{column: pk})
+            for pk, row_terms in terms.items()
+            for name in row_terms
+        )
+
+
+def get_nearest_terms(word, count):
+    """
+    The count terms closest to word by trigram word similarity, closest
+    first, with whether they title any products, brands and categories.
+    The GiST index returns them in that order, only the first ones are read.
+    """
+    links = {
+        f"has_{model._meta.model_name}": Exists(
+            get_term_links(model)[0].objects.filter(suggestterm_id=OuterRef("pk"))
+        )
+        for model in (Product, Brand, Category)
+    }
+    return list(
+        SuggestTerm.objects.filter(term__trigram_word_similar=word)
+        .annotate(distance=TrigramWordDistance(word, "term"), **links)
+        .order_by("distance")
+        .values("pk", *links)[:count]
+    )
+
+
+def get_linked(model, term_id):
+    """Ids of the rows of model titled with the term"""
+    through, column = get_term_links(model)
+    return through.objects.filter(suggestterm_id=term_id).values(column)
+
+
+def suggest_products(terms, required, limit):
+    """
+    Products titled with the terms, a term at a time: a common term has
+    tens of thousands of products, only the first ones of its index
+    entries are read. required are the terms every product must have.
+    """
+    through, _ = get_term_links(Product)
+    products = []
+    for term_id in terms:
+        links = through.objects.filter(suggestterm_id=term_id)
+        for required_id in required:
+            links = links.filter(product_id__in=get_linked(Product, required_id))
+        ids = (
+            links.exclude(product_id__in=[product["id"] for product in products])
+            .order_by("product_id")
+            .values("product_id")[: limit - len(products)]
+        )
+        products += Product.objects.filter(pk__in=ids).values("id", "title", "slug")
+        if len(products) >= limit:
+            break
+    return products
+
+
+def suggest_rows(queryset, terms, required, limit, fields):
+    """Rows of queryset titled with the terms, by the rank of their term"""
+    if not terms:
+        return []
+    for required_id in required:
+        queryset = queryset.filter(pk__in=get_linked(queryset.model, required_id))
+    rows = queryset.filter(suggest_terms__in=terms).values(*fields, "suggest_terms")
+    ranks = {term_id: rank for rank, term_id in enumerate(terms)}
+    suggested = {}
+    for row in sorted(rows, key=lambda row: ranks[row["suggest_terms"]]):
+        del row["suggest_terms"]
+        # A row with several of the terms is ranked by the closest
+        suggested.setdefault(row["id"], row)
+    return list(suggested.values())[:limit]
+
+
+def suggest(text, limit):
+    """
+    Autocomplete suggestions for the search box. The typed words are
+    matched against the suggestion terms: the last one, still being typed,
+    by its nearest terms, the ones before it by their nearest term each.
+    """
+    suggestions = {"products": [], "brands": [], "categories": []}
+    words = TERM_RE.findall(text.lower())
+    if not words:
+        return suggestions
+
+    required = []
+    for word in words[:-1]:
+        nearest = get_nearest_terms(word, 1)
+        if not nearest:
+            return suggestions
+        required.append(nearest[0]["pk"])
+    nearest = get_nearest_terms(words[-1], SUGGEST_TERMS)
+
+    def titling(model):
+        return [term["pk"] for term in nearest if term[f"has_{model._meta.model_name}"]]
+
+    suggestions["products"] = suggest_products(titling(Product), required, limit)
+    suggestions["brands"] = suggest_rows(
+        Brand.objects.all(), titling(Brand), required, limit, ["id", "title"]
+    )
+    suggestions["categories"] = suggest_rows(
+        Category.objects.all(),
+        titling(Category),
+        required,
+        limit,
+        ["id", "title", "slug"],
+    )
+    return suggestions
@@ -1,7 +1,11 @@
+from django.conf import settings
+from modeltranslation.utils import build_localized_fieldname, resolution_order
 from rest_framework import serializers
 
 
+from common.images import get_image_url, get_srcset
 from common.serializers import FileSerializer
+from utils.serializers import SparseFieldsMixin
 from .models import (
     Category,
     ProductImage,
@@ -12,6 +16,18 @@ from .models import (
 )
 
 
+def get_cover_image_url(product, request=None):
+    if hasattr(product, "cover_image"):
+        # Annotated by Product.objects.with_cover_image()
+        image, variants = product.cover_image, product.cover_variants
+    else:
+        image_obj = product.product_images.first()
+        image = image_obj.image.name if image_obj else None
+        variants = image_obj.variants if image_obj else None
+
+    return get_image_url(ProductImage.image.field.storage, image, variants, request)
+
+
 class BrandSerializer(serializers.ModelSerializer):
     class Meta:
         model = Brand
@@ -26,7 +42,7 @@ class CategoryChildrenSerializer(serializers.ModelSerializer):
         fields = ["id", "title", "slug", "brands"]
 
     def get_brands(self, obj):
-        if obj.parent is not None:
+        if obj.parent_id is not None:
             return BrandSerializer(obj.brands.all(), many=True).data
         return None
 
@@ -53,18 +69,23 @@ class CategorySerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     url = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductImage
-        fields = ["id", "url"]
+        fields = ["id", "url", "srcset"]
 
     def get_url(self, obj):
+        return get_image_url(
+            obj.image.storage, obj.image.name, obj.variants, self.context.get("request")
+        )
+
+    def get_srcset(self, obj):
         request = self.context.get("request")
-        if obj.image:
-            return (
-                request.build_absolute_uri(obj.image.url) if request else obj.image.url
-            )
-        return None
+        return get_srcset(
+            obj.variants,
+            lambda name: get_image_url(obj.image.storage, name, request=request),
+        )
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
@@ -89,13 +110,13 @@ class ProductDiscountSerializer(serializers.ModelSerializer):
         ]
 
     def get_discounted_price(self, obj):
-        return obj.discounted_price()
+        return obj.product.effective_price
 
     def get_is_active(self, obj):
-        return obj.is_active()
+        return obj.product.discount_active
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     discount = ProductDiscountSerializer()
     image = serializers.SerializerMethodField()
 
@@ -114,20 +135,78 @@ class ProductSerializer(serializers.ModelSerializer):
         ]
 
     def get_image(self, obj):
-        image_obj = obj.product_images.first()
-        if image_obj and image_obj.image:
-            request = self.context.get("request")
-            return (
-                request.build_absolute_uri(image_obj.image.url)
-                if request
-                else image_obj.image.url
-            )
-        return None
+        return get_cover_image_url(obj, self.context.get("request"))
+
+
+class ProductBatchSerializer(serializers.Serializer):
+    max_ids = 100
+
+    ids = serializers.ListField(
+        child=serializers.UUIDField(), allow_empty=False, max_length=max_ids
+    )
+
+
+class ProductImportDetailSerializer(serializers.Serializer):
+    key_uz = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    key_ru = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    key_en = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    value_uz = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    value_ru = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    value_en = serializers.CharField(max_length=255, required=False, allow_blank=True)
+
+
+class ProductImportSerializer(serializers.Serializer):
+    """A row of a catalog import, see products.importer"""
+
+    title_uz = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    title_ru = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    title_en = serializers.CharField(max_length=255)
+    slug = serializers.SlugField(required=False, allow_blank=True)
+    short_description_uz = serializers.CharField(
+        max_length=255, required=False, allow_blank=True
+    )
+    short_description_ru = serializers.CharField(
+        max_length=255, required=False, allow_blank=True
+    )
+    short_description_en = serializers.CharField(
+        max_length=255, required=False, allow_blank=True
+    )
+    description_uz = serializers.CharField(required=False, allow_blank=True)
+    description_ru = serializers.CharField(required=False, allow_blank=True)
+    description_en = serializers.CharField(required=False, allow_blank=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    is_in_stock = serializers.BooleanField(default=True)
+    is_pre_order = serializers.BooleanField(default=False)
+    brand = serializers.CharField(max_length=225)
+    categories = serializers.ListField(
+        child=serializers.CharField(), required=False, default=list
+    )
+    details = ProductImportDetailSerializer(many=True, required=False, default=list)
+    images = serializers.ListField(
+        child=serializers.CharField(max_length=100), required=False, default=list
+    )
+
+    # Product.full_clean() requires them in the default language, fallbacks
+    # included
+    translated_fields = ["title", "short_description", "description"]
+
+    def validate(self, attrs):
+        languages = resolution_order(settings.LANGUAGE_CODE)
+        errors = {}
+        for name in self.translated_fields:
+            if not any(
+                attrs.get(build_localized_fieldname(name, lang)) for lang in languages
+            ):
+                field = build_localized_fieldname(name, settings.LANGUAGE_CODE)
+                errors[field] = ["This field is required."]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
 
 
 class ProductRetrieveSerializer(serializers.ModelSerializer):
     discount = ProductDiscountSerializer()
-    images = ProductImageSerializer(many=True, read_only=True, source="product_images")
+    images = serializers.SerializerMethodField()
     details = ProductDetailSerializer(many=True, source="product_details")
 
     class Meta:
@@ -145,3 +224,11 @@ class ProductRetrieveSerializer(serializers.ModelSerializer):
             "images",
             "details",
         ]
+
+    def get_images(self, obj):
+        if hasattr(obj, "image_rows"):
+            # Annotated by Product.objects.for_detail()
+            images = [ProductImage(**row) for row in obj.image_rows]
+        else:
+            images = obj.product_images.all()
+        return ProductImageSerializer(images, many=True, context=self.context).data
@@ -0,0 +1,82 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from common.models import File
+from common.signals import track_references
+from utils.cache import invalidate_tags, model_tag
+
+from .models import (
+    CATEGORY_TREE_TAG,
+    Brand,
+    Category,
+    Product,
+    ProductDetail,
+    ProductDiscount,
+    ProductImage,
+    product_tag,
+)
+from .pricing import refresh_effective_prices
+from .search import update_search_vectors, update_suggest_terms
+
+track_references(ProductImage, "image")
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_vector(sender, instance, **kwargs):
+    update_search_vectors(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def update_title_suggest_terms(sender, instance, **kwargs):
+    update_suggest_terms(sender.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Product)
+@receiver([post_save, post_delete], sender=ProductDiscount)
+def update_effective_price(sender, instance, **kwargs):
+    product_id = instance.pk if sender is Product else instance.product_id
+    refresh_effective_prices(Product.objects.filter(pk=product_id))
+
+
+@receiver([post_save, post_delete], sender=ProductDetail)
+def update_detail_search_vector(sender, instance, **kwargs):
+    update_search_vectors(Product.objects.filter(pk=instance.product_id_id))
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Brand)
+@receiver([post_save, post_delete], sender=File)
+@receiver(m2m_changed, sender=Category.brands.through)
+def invalidate_category_tree(sender, **kwargs):
+    invalidate_tags(CATEGORY_TREE_TAG)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductDetail)
+@receiver([post_save, post_delete], sender=ProductDiscount)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Brand)
+def invalidate_table(sender, **kwargs):
+    invalidate_tags(model_tag(sender))
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def invalidate_product_categories(sender, **kwargs):
+    invalidate_tags(model_tag(Product))
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductDetail)
+@receiver([post_save, post_delete], sender=ProductDiscount)
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_product(sender, instance, **kwargs):
+    if sender is Product:
+        product_id = instance.pk
+    elif sender is ProductDiscount:
+        product_id = instance.product_id
+    else:
+        product_id = instance.product_id_id
+    invalidate_tags(product_tag(product_id))
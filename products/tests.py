@@ -1,3 +1,1158 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from xml.etree import ElementTree
+
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from common.models import File, ImageJob, StoredFile
+from utils.renderers import FastJSONRenderer
+from utils.response_cache import get_response_cache_stats
+
+from .management.commands.reencode_images import Command as ReencodeImagesCommand
+from .models import (
+    Brand,
+    Category,
+    Product,
+    ProductDetail,
+    ProductDiscount,
+    ProductImage,
+    SuggestTerm,
+)
+from .pricing import get_next_discount_change, refresh_effective_prices
+from .views import ListCategoryAPIView, ListProductAPIView
+
 
 # Create your tests here.
+
+
+VARIANTS = {
+    "160": "uploads/files/image_160w.webp",
+    "320": "uploads/files/image_320w.webp",
+    "800": "uploads/files/image.webp",
+}
+
+
+def make_png(name, color="red"):
+    output = BytesIO()
+    Image.new("RGB", (400, 300), color).save(output, format="PNG")
+    return ContentFile(output.getvalue(), name=name)
+
+
+class ProductTestMixin:
+    def create_products(self, count):
+        brand = Brand.objects.create(title="Brand")
+        now = timezone.now()
+        for index in range(count):
+            product = Product.objects.create(
+                title_en=f"Product {index}",
+                title_ru=f"Product {index}",
+                short_description=f"Short description {index}",
+                description=f"Description {index}",
+                price=100,
+                brand_id=brand,
+            )
+            ProductDiscount.objects.create(
+                product=product,
+                percent=10,
+                start_date=now - timedelta(days=1),
+                end_date=now + timedelta(days=1),
+            )
+            for order in range(2):
+                ProductImage.objects.create(
+                    product_id=product,
+                    image=f"uploads/products/files/{index}-{order}.webp",
+                    order=order,
+                )
+
+
+class ListProductQueryBudgetTestCase(ProductTestMixin, APITestCase):
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.create_products(10)
+
+        # One COUNT for the paginator and one SELECT for the page
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("product_list"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 10)
+        for item in response.data["results"]:
+            self.assertTrue(item["image"].endswith("-0.webp"))
+            self.assertTrue(item["discount"]["is_active"])
+
+
+class ProductCursorPaginationTestCase(ProductTestMixin, APITestCase):
+    def walk(self, ordering):
+        url = f"{reverse('product_list')}?pagination=cursor&ordering={ordering}"
+        titles = []
+        while url:
+            # No COUNT query: one SELECT per page
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            titles.extend(item["title"] for item in response.data["results"])
+            url = response.data["next"]
+        return titles
+
+    def test_walks_every_product_once(self):
+        self.create_products(25)
+        expected = sorted(Product.objects.values_list("title_ru", flat=True))
+
+        self.assertEqual(self.walk("title"), expected)
+        self.assertEqual(self.walk("-title"), expected[::-1])
+        self.assertCountEqual(self.walk("price"), expected)
+
+    def test_empty_translation_sorts_by_fallback(self):
+        self.create_products(15)
+        # Shown with its Uzbek title, as the Russian one is empty
+        Product.objects.filter(title_ru="Product 0").update(
+            title_ru="", title_uz="Zebra"
+        )
+        expected = sorted(
+            title_ru or title_uz
+            for title_ru, title_uz in Product.objects.values_list(
+                "title_ru", "title_uz"
+            )
+        )
+
+        self.assertEqual(expected[-1], "Zebra")
+        self.assertEqual(self.walk("title"), expected)
+
+    def test_cursor_is_an_index_range(self):
+        self.create_products(15)
+        url = f"{reverse('product_list')}?pagination=cursor"
+        next_url = self.client.get(url).data["next"]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(next_url)
+        # A row comparison, not an OR the planner can only filter with
+        self.assertIn(
+            '("products_product"."created_at", "products_product"."id") < (',
+            queries[0]["sql"],
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN {queries[0]['sql']}")
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertRegex(plan, r"Index Cond: \(ROW\(created_at, id\) < ROW\(")
+
+    def test_previous_link_returns_previous_page(self):
+        self.create_products(15)
+        url = f"{reverse('product_list')}?pagination=cursor&ordering=title"
+        first = self.client.get(url).data
+        second = self.client.get(first["next"]).data
+
+        self.assertIsNone(first["previous"])
+        self.assertEqual(self.client.get(second["previous"]).data, first)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse("product_list"), {"pagination": "cursor", "cursor": "garbage"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductSearchTestCase(ProductTestMixin, APITestCase):
+    def test_searches_every_translation(self):
+        self.create_products(3)
+        product = Product.objects.first()
+        product.title_uz = "Simsiz quloqchin"
+        product.title_en = "Wireless headphones"
+        product.save()
+        ProductDetail.objects.create(
+            product_id=product, key_ru="Цвет", value_ru="Красный", value_en="Red"
+        )
+
+        for query in ["quloqchin", "headphone", "красные", "red"]:
+            response = self.client.get(reverse("product_list"), {"q": query})
+            self.assertEqual(
+                [item["id"] for item in response.data["results"]],
+                [str(product.id)],
+                query,
+            )
+
+
+class SuggestTestCase(ProductTestMixin, APITestCase):
+    def test_tolerates_typos(self):
+        self.create_products(3)
+        product = Product.objects.first()
+        product.title_en = "Wireless headphones"
+        product.save()
+
+        response = self.client.get(reverse("product_suggest"), {"q": "headphnes"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item["slug"] for item in response.data["products"]], [product.slug]
+        )
+        self.assertEqual(response.data["brands"], [])
+
+    def test_every_word_is_matched(self):
+        self.create_products(3)
+        products = list(Product.objects.order_by("title_ru"))
+        products[0].title_en = "Wireless headphones"
+        products[0].save()
+        products[1].title_en = "Wired headphones"
+        products[1].save()
+
+        def suggested(text):
+            response = self.client.get(reverse("product_suggest"), {"q": text})
+            return {item["slug"] for item in response.data["products"]}
+
+        self.assertEqual(suggested("headph"), {products[0].slug, products[1].slug})
+        self.assertEqual(suggested("wireless headph"), {products[0].slug})
+        self.assertEqual(suggested("?!"), set())
+
+    def test_brands_and_categories(self):
+        samsung = Brand.objects.create(title="Samsung")
+        Brand.objects.create(title="Sony")
+        phones = Category.objects.create(title_ru="Смартфоны", title_en="Smartphones")
+
+        response = self.client.get(reverse("product_suggest"), {"q": "samsu"})
+        self.assertEqual(
+            response.data["brands"], [{"id": samsung.id, "title": "Samsung"}]
+        )
+        response = self.client.get(reverse("product_suggest"), {"q": "смартф"})
+        self.assertEqual(
+            [item["slug"] for item in response.data["categories"]], [phones.slug]
+        )
+
+    def test_terms_follow_title_changes(self):
+        self.create_products(1)
+        product = Product.objects.get()
+        product.title_en = "Wireless headphones"
+        product.save()
+        self.assertTrue(product.suggest_terms.filter(term="headphones").exists())
+
+        product.title_en = "Smart watch"
+        product.save()
+        self.assertEqual(
+            set(product.suggest_terms.values_list("term", flat=True)),
+            {"smart", "watch", "product"},
+        )
+        # Left behind, but never suggested
+        self.assertTrue(SuggestTerm.objects.filter(term="headphones").exists())
+        response = self.client.get(reverse("product_suggest"), {"q": "headphones"})
+        self.assertEqual(response.data["products"], [])
+
+
+class ProductCategoryFilterTestCase(ProductTestMixin, APITestCase):
+    def test_parent_slug_matches_whole_subtree(self):
+        self.create_products(4)
+        products = list(Product.objects.order_by("title_ru"))
+        phones = Category.objects.create(title_en="Phones", title_ru="Phones")
+        smartphones = Category.objects.create(
+            title_en="Smartphones", title_ru="Smartphones", parent=phones
+        )
+        android = Category.objects.create(
+            title_en="Android", title_ru="Android", parent=smartphones
+        )
+        laptops = Category.objects.create(title_en="Laptops", title_ru="Laptops")
+        products[0].categories.add(phones)
+        products[1].categories.add(android)
+        products[2].categories.add(laptops)
+
+        def filtered(slugs, queries=2):
+            # Slugs are resolved inside the COUNT and the page SELECT
+            with self.assertNumQueries(queries):
+                response = self.client.get(reverse("product_list"), {"slug": slugs})
+            return {item["id"] for item in response.data["results"]}
+
+        self.assertEqual(filtered("phones"), {str(products[0].id), str(products[1].id)})
+        self.assertEqual(filtered(smartphones.slug), {str(products[1].id)})
+        self.assertEqual(
+            filtered(f"{android.slug},laptops,unknown"),
+            {str(products[1].id), str(products[2].id)},
+        )
+        self.assertEqual(filtered("unknown", queries=1), set())
+
+
+class ListCategoryTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        brands = [Brand.objects.create(title=f"Brand {index}") for index in range(3)]
+        for index in range(3):
+            parent = Category.objects.create(
+                title_en=f"Parent {index}", title_ru=f"Parent {index}"
+            )
+            for child_index in range(3):
+                child = Category.objects.create(
+                    title_en=f"Child {child_index}",
+                    title_ru=f"Child {child_index}",
+                    parent=parent,
+                )
+                child.brands.add(*brands)
+
+    def test_tree_is_built_in_constant_queries_and_cached(self):
+        # Roots, children and their brands
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("category_list"))
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(len(response.data[0]["children"][0]["brands"]), 3)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse("category_list"))
+        self.assertEqual(cached.data, response.data)
+
+    def test_tree_is_rebuilt_on_change(self):
+        self.client.get(reverse("category_list"))
+        child = Category.objects.filter(parent__isnull=False).first()
+        child.brands.add(Brand.objects.create(title="New"))
+
+        response = self.client.get(reverse("category_list"))
+        brands = [
+            brand["title"]
+            for parent in response.data
+            for category in parent["children"]
+            for brand in category["brands"]
+        ]
+        self.assertIn("New", brands)
+
+
+class ProductFacetsTestCase(ProductTestMixin, APITestCase):
+    def test_facets_follow_filters(self):
+        self.create_products(4)
+        products = list(Product.objects.order_by("title_ru"))
+        other_brand = Brand.objects.create(title="Other")
+        products[0].brand_id = other_brand
+        products[0].price = 50
+        products[0].is_in_stock = False
+        products[0].save()
+        category = Category.objects.create(title_en="Phones", title_ru="Phones")
+        category.products.add(products[0], products[1])
+
+        # Count, page and one query per facet
+        with self.assertNumQueries(6):
+            response = self.client.get(
+                reverse("product_list"),
+                {"facets": "brand,category,price,stock,unknown"},
+            )
+        facets = response.data["facets"]
+        self.assertEqual(
+            [(brand["title"], brand["count"]) for brand in facets["brand"]],
+            [("Brand", 3), ("Other", 1)],
+        )
+        self.assertEqual(
+            [(item["slug"], item["count"]) for item in facets["category"]],
+            [("phones", 2)],
+        )
+        self.assertEqual(facets["price"], {"min": 45, "max": 90})
+        self.assertEqual(
+            facets["stock"], {"in_stock": 3, "out_of_stock": 1, "pre_order": 0}
+        )
+
+        response = self.client.get(
+            reverse("product_list"), {"facets": "brand", "brand": "Other"}
+        )
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(
+            [brand["title"] for brand in response.data["facets"]["brand"]], ["Other"]
+        )
+
+
+class ProductEffectivePriceTestCase(ProductTestMixin, APITestCase):
+    def setUp(self):
+        self.create_products(3)
+        self.cheap, self.expired, self.plain = Product.objects.order_by("title_ru")
+        self.cheap.price = 60
+        self.cheap.save()
+        # 100 without discount, 90 with it
+        self.expired.discount.end_date = timezone.now() - timedelta(hours=1)
+        self.expired.discount.save()
+        self.plain.discount.percent = 5
+        self.plain.discount.save()
+
+    def get_ids(self, params):
+        response = self.client.get(reverse("product_list"), params)
+        return [item["id"] for item in response.data["results"]]
+
+    def test_orders_by_discounted_price(self):
+        expected = [str(self.cheap.id), str(self.plain.id), str(self.expired.id)]
+        self.assertEqual(self.get_ids({"ordering": "effective_price"}), expected)
+        self.assertEqual(self.get_ids({"ordering": "-effective_price"}), expected[::-1])
+        self.assertEqual(
+            self.get_ids({"ordering": "effective_price", "pagination": "cursor"}),
+            expected,
+        )
+
+    def test_filters_by_discounted_price(self):
+        self.assertEqual(
+            self.get_ids({"min_price": 90, "max_price": 96}), [str(self.plain.id)]
+        )
+
+    def test_scheduler_flips_discounts_at_window_boundaries(self):
+        end_date = self.plain.discount.end_date
+        self.assertEqual(
+            Product.objects.get(pk=self.plain.pk).effective_price, Decimal("95.00")
+        )
+
+        # Nothing to do while the windows are unchanged
+        self.assertEqual(refresh_effective_prices(Product.objects.all()), [])
+
+        after_end = end_date + timedelta(microseconds=1)
+        self.assertEqual(get_next_discount_change(timezone.now()), end_date)
+        refresh_effective_prices(Product.objects.all(), now=after_end)
+        product = Product.objects.get(pk=self.plain.pk)
+        self.assertEqual(product.effective_price, product.price)
+        self.assertFalse(product.discount_active)
+
+
+class ConditionalGetTestCase(ProductTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.create_products(2)
+        self.product = Product.objects.first()
+
+    def assertRevalidates(self, url, change):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertIn("Last-Modified", response.headers)
+        self.assertIn("no-cache", response.headers["Cache-Control"])
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers["ETag"], etag)
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_product_list(self):
+        def change():
+            self.product.price = 50
+            self.product.save()
+
+        self.assertRevalidates(reverse("product_list"), change)
+
+    def test_product_detail(self):
+        def change():
+            self.product.discount.percent = 20
+            self.product.discount.save()
+
+        self.assertRevalidates(
+            reverse("product_detail", args=[self.product.id]), change
+        )
+
+    def test_category_list(self):
+        self.assertRevalidates(
+            reverse("category_list"),
+            lambda: Category.objects.create(title_en="New", title_ru="New"),
+        )
+
+    def test_search_sees_new_details(self):
+        url = f"{reverse('product_list')}?q=zebra"
+        self.assertEqual(self.client.get(url).data["count"], 0)
+
+        def change():
+            ProductDetail.objects.create(
+                product_id=self.product, key_en="Pattern", value_en="Zebra"
+            )
+
+        self.assertRevalidates(url, change)
+        response = self.client.get(url)
+        self.assertEqual(response.headers["X-Cache"], "HIT")
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]], [str(self.product.id)]
+        )
+
+    def test_query_string_is_part_of_the_etag(self):
+        etag = self.client.get(reverse("product_list")).headers["ETag"]
+        response = self.client.get(
+            reverse("product_list"), {"page": 1}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ResponseCacheTestCase(ProductTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.create_products(2)
+        self.first, self.second = Product.objects.order_by("created_at")
+
+    def test_hit_skips_the_database(self):
+        url = reverse("product_list")
+        response = self.client.get(url, {"lang": "en", "page": 1})
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+
+        # The query string is normalized
+        with self.assertNumQueries(0):
+            cached = self.client.get(f"{url}?page=1&lang=en&title=")
+        self.assertEqual(cached.headers["X-Cache"], "HIT")
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(get_response_cache_stats(), {"hits": 1, "misses": 1})
+
+        russian = self.client.get(url, {"lang": "ru", "page": 1})
+        self.assertEqual(russian.headers["X-Cache"], "MISS")
+
+    def test_authenticated_requests_bypass_the_cache(self):
+        user = get_user_model().objects.create_user(
+            email="user@example.com", password="password"
+        )
+        self.client.force_authenticate(user)
+        self.client.get(reverse("product_list"))
+        response = self.client.get(reverse("product_list"))
+        self.assertNotIn("X-Cache", response.headers)
+
+
+class ProductDetailTestCase(ProductTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.create_products(2)
+        self.first, self.second = Product.objects.order_by("created_at")
+        ProductDetail.objects.create(
+            product_id=self.first, key_en="Color", value_en="Black"
+        )
+
+    def detail_url(self, product):
+        return reverse("product_detail", args=[product.id])
+
+    def test_loads_in_two_queries_and_caches_the_payload(self):
+        # Product with discount and images, then the details
+        with self.assertNumQueries(2):
+            response = self.client.get(self.detail_url(self.first), {"lang": "en"})
+        self.assertEqual(len(response.data["images"]), 2)
+        self.assertEqual(response.data["details"][0]["value"], "Black")
+        self.assertEqual(response.data["discount"]["percent"], 10)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.detail_url(self.first), {"lang": "en"})
+        self.assertEqual(cached.data, response.data)
+
+    def test_image_variants(self):
+        ProductImage.objects.filter(product_id=self.first, order=0).update(
+            variants=VARIANTS
+        )
+        response = self.client.get(self.detail_url(self.first))
+        image = response.data["images"][0]
+        self.assertEqual(list(image["srcset"]), ["160", "320", "800"])
+        self.assertTrue(image["url"].endswith("-0.webp"))
+
+        # The size hint is part of the cached payload key
+        response = self.client.get(self.detail_url(self.first), {"img": "thumb"})
+        image = response.data["images"][0]
+        self.assertEqual(image["url"], image["srcset"]["160"])
+        self.assertEqual(response.data["images"][1]["srcset"], {})
+
+    def test_slug_lookup(self):
+        response = self.client.get(
+            reverse("product_detail_slug", args=[self.first.slug])
+        )
+        self.assertEqual(response.data["id"], str(self.first.id))
+
+        missing = self.client.get(reverse("product_detail_slug", args=["missing"]))
+        self.assertEqual(missing.status_code, 404)
+
+    def test_product_change_expires_only_its_detail(self):
+        self.client.get(self.detail_url(self.first))
+        self.client.get(self.detail_url(self.second))
+
+        image = self.first.product_images.first()
+        image.order = 5
+        image.save()
+
+        with self.assertNumQueries(2):
+            self.client.get(self.detail_url(self.first))
+        with self.assertNumQueries(0):
+            self.client.get(self.detail_url(self.second))
+
+    def test_scheduler_expires_the_products_it_changes(self):
+        self.client.get(self.detail_url(self.first))
+        self.client.get(self.detail_url(self.second))
+
+        # Like the clock passing the end of the window, no signal is sent
+        ProductDiscount.objects.filter(product=self.first).update(
+            end_date=timezone.now() - timedelta(seconds=1)
+        )
+        call_command("sync_discounts", "--once", stdout=StringIO())
+
+        first = self.client.get(self.detail_url(self.first))
+        self.assertFalse(first.data["discount"]["is_active"])
+        with self.assertNumQueries(0):
+            self.client.get(self.detail_url(self.second))
+
+    def test_product_without_discount(self):
+        self.second.discount.delete()
+        response = self.client.get(self.detail_url(self.second))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data["discount"])
+
+
+class ProductBatchTestCase(ProductTestMixin, APITestCase):
+    def setUp(self):
+        self.create_products(3)
+        self.ids = [str(id) for id in Product.objects.values_list("id", flat=True)]
+
+    def test_preserves_order_and_reports_missing(self):
+        missing = "00000000-0000-0000-0000-000000000000"
+        ids = [self.ids[2], missing, self.ids[0], self.ids[2]]
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("product_batch"), {"ids": ",".join(ids)})
+        self.assertEqual(
+            [product["id"] for product in response.data["results"]],
+            [self.ids[2], self.ids[0]],
+        )
+        self.assertEqual(response.data["missing"], [missing])
+        self.assertIsNotNone(response.data["results"][0]["image"])
+
+    def test_post_body(self):
+        response = self.client.post(
+            reverse("product_batch"), {"ids": self.ids}, format="json"
+        )
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_validates_ids(self):
+        url = reverse("product_batch")
+        self.assertEqual(self.client.get(url, {"ids": "garbage"}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 400)
+        too_many = {"ids": self.ids * 34}
+        response = self.client.post(url, too_many, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class LocalizedQueryTestCase(ProductTestMixin, APITestCase):
+    def test_list_loads_the_active_language_only(self):
+        self.create_products(1)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("product_list"), {"lang": "en"})
+        self.assertEqual(response.data["results"][0]["title"], "Product 0")
+
+        sql = context.captured_queries[-1]["sql"]
+        # English falls back to Uzbek
+        self.assertIn('"title_en"', sql)
+        self.assertIn('"title_uz"', sql)
+        self.assertNotIn('"title_ru"', sql)
+        self.assertNotIn("description_en", sql.replace("short_description", ""))
+        self.assertNotIn('"search_vector"', sql)
+
+    def test_fallback_is_used(self):
+        self.create_products(1)
+        Product.objects.update(title_ru="")
+        product = Product.objects.get()
+        product.title_uz = "Mahsulot"
+        product.save()
+
+        response = self.client.get(reverse("product_list"), {"lang": "ru"})
+        self.assertEqual(response.data["results"][0]["title"], "Mahsulot")
+
+
+class SparseFieldsetTestCase(ProductTestMixin, APITestCase):
+    def setUp(self):
+        self.create_products(2)
+
+    def test_fields_drops_the_discount_join_and_columns(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse("product_list"), {"fields": "id,title,price"}
+            )
+        self.assertEqual(set(response.data["results"][0]), {"id", "title", "price"})
+        sql = context.captured_queries[-1]["sql"]
+        self.assertNotIn("products_productdiscount", sql)
+        self.assertNotIn("products_productimage", sql)
+        self.assertNotIn("short_description", sql)
+
+    def test_omit(self):
+        response = self.client.get(
+            reverse("product_list"), {"omit": "discount,short_description"}
+        )
+        product = response.data["results"][0]
+        self.assertNotIn("discount", product)
+        self.assertNotIn("short_description", product)
+        self.assertIsNotNone(product["image"])
+
+    def test_batch_honours_fields(self):
+        ids = ",".join(str(pk) for pk in Product.objects.values_list("pk", flat=True))
+        response = self.client.get(
+            reverse("product_batch"), {"ids": ids, "fields": "id,image"}
+        )
+        self.assertEqual(set(response.data["results"][0]), {"id", "image"})
+
+
+class FastJSONRendererTestCase(ProductTestMixin, APITestCase):
+    def assertSameOutput(self, data):
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_matches_the_stock_renderer(self):
+        self.create_products(3)
+        ProductDetail.objects.create(
+            product_id=Product.objects.first(), key_en="Key", value_en="Value"
+        )
+        self.assertSameOutput(self.client.get(reverse("product_list")).data)
+        self.assertSameOutput(
+            self.client.get(reverse("product_list"), {"facets": "price"}).data
+        )
+        self.assertSameOutput(self.client.get(reverse("category_list")).data)
+
+    def test_encodes_like_drf(self):
+        now = timezone.now()
+        self.assertSameOutput(
+            {
+                "uuid": Product.objects.model().id,
+                "decimal": Decimal("10.50"),
+                "utc": now,
+                "local": timezone.localtime(now),
+                "date": now.date(),
+                "time": now.time(),
+                "lazy": gettext_lazy("Title"),
+                "separator": "a\u2028b\u2029c",
+                1: "integer key",
+            }
+        )
+
+    def test_parser_round_trip(self):
+        self.create_products(1)
+        ids = [str(Product.objects.get().pk)]
+        response = self.client.post(
+            reverse("product_batch"), {"ids": ids}, format="json"
+        )
+        self.assertEqual(response.data["results"][0]["id"], ids[0])
+
+        response = self.client.post(
+            reverse("product_batch"), "{", content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class FastSerializationContractTestCase(ProductTestMixin, APITestCase):
+    def setUp(self):
+        self.create_products(3)
+        product = Product.objects.first()
+        product.discount.delete()
+        product.product_images.all().delete()
+        Product.objects.filter(pk=product.pk).update(title_ru="", slug=None)
+
+        brands = [Brand.objects.create(title=title) for title in ["b", "a", "c"]]
+        image = File.objects.create(file="uploads/files/image.webp")
+        File.objects.filter(pk=image.pk).update(variants=VARIANTS)
+        ProductImage.objects.filter(order=0).update(variants=VARIANTS)
+        for index in range(2):
+            parent = Category.objects.create(
+                title_en=f"Parent {index}",
+                title_ru=f"Parent {index}",
+                image_id=image if index else None,
+                is_carousel=bool(index),
+            )
+            child = Category.objects.create(
+                title_en="Child", title_ru="", parent=parent
+            )
+            child.brands.add(*brands[index:])
+
+    def assertSameResponse(self, view, url, params):
+        responses = []
+        for fast in [True, False]:
+            cache.clear()
+            with mock.patch.object(view, "fast_serialization", fast):
+                response = self.client.get(url, params)
+            responses.append(JSONRenderer().render(response.data))
+        self.assertEqual(responses[0], responses[1])
+
+    def test_product_list(self):
+        url = reverse("product_list")
+        for params in [
+            {},
+            {"lang": "ru"},
+            {"lang": "en", "pagination": "cursor", "ordering": "-price"},
+            {"fields": "id,image,discount"},
+            {"omit": "discount", "facets": "price"},
+            {"img": "thumb"},
+            {"img": "500"},
+        ]:
+            with self.subTest(params=params):
+                self.assertSameResponse(ListProductAPIView, url, params)
+
+    def test_category_tree(self):
+        url = reverse("category_list")
+        for params in [{}, {"lang": "ru"}, {"is_carousel": "true"}, {"img": "small"}]:
+            with self.subTest(params=params):
+                self.assertSameResponse(ListCategoryAPIView, url, params)
+
+
+class ProductExportTestCase(ProductTestMixin, APITestCase):
+    def setUp(self):
+        self.create_products(3)
+        product = Product.objects.order_by("id").first()
+        ProductDetail.objects.create(
+            product_id=product, key_en="Color", value_en="Black & white"
+        )
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@example.com", password="password"
+        )
+
+    def export(self, feed):
+        self.client.force_authenticate(self.admin)
+        # The language has to outlive the view while the body streams
+        response = self.client.get(
+            reverse("product_export"), {"feed": feed, "lang": "en"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export("csv"))))
+        self.assertEqual(len(rows), 3)
+        row = rows[0]
+        self.assertEqual(row["sale_price"], "90.00 UZS")
+        self.assertEqual(row["availability"], "in_stock")
+        self.assertTrue(row["image_link"].startswith("http://testserver/media/"))
+        self.assertEqual(row["product_detail"], "Color: Black & white")
+
+    def test_jsonl(self):
+        items = [json.loads(line) for line in self.export("jsonl").splitlines()]
+        self.assertEqual(len(items), 3)
+        self.assertEqual(len(items[0]["additional_image_link"]), 1)
+
+    def test_xml(self):
+        root = ElementTree.fromstring(self.export("xml"))
+        items = root.findall("channel/item")
+        self.assertEqual(len(items), 3)
+        detail = items[0].find("{http://base.google.com/ns/1.0}product_detail")
+        self.assertEqual(detail[1].text, "Black & white")
+
+    def test_requires_admin(self):
+        response = self.client.get(reverse("product_export"))
+        self.assertIn(response.status_code, [401, 403])
+
+    def test_unknown_feed(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse("product_export"), {"feed": "pdf"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_queries_per_chunk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "feed.jsonl")
+            # Products, then images and details once per chunk of two
+            with self.assertNumQueries(5):
+                call_command(
+                    "export_products",
+                    "--feed=jsonl",
+                    "--chunk-size=2",
+                    f"--output={output}",
+                    stderr=StringIO(),
+                )
+            with open(output, encoding="utf-8") as file:
+                self.assertEqual(len(file.readlines()), 3)
+
+
+class ProductImportTestCase(ProductTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.create_products(1)
+        self.category = Category.objects.create(title_en="Phones", slug="phones")
+
+    def write_file(self, name, content):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def write_jsonl(self, *rows):
+        defaults = {
+            "title_ru": "Товар",
+            "short_description_ru": "Кратко",
+            "description_ru": "Описание",
+            "price": "1",
+            "brand": "Brand",
+        }
+        return self.write_file(
+            "catalog.jsonl",
+            "".join(json.dumps({**defaults, **row}) + "\n" for row in rows),
+        )
+
+    def run_import(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command("import_products", *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv(self):
+        path = self.write_file(
+            "catalog.csv",
+            "title_en,title_ru,short_description_uz,description_uz,price,brand,"
+            "categories,images,details\n"
+            'Phone,Телефон,Qisqa,Tavsif,10.50,Acme,phones,a.webp|b.png,"[{""key_en"":'
+            ' ""Color"", ""value_en"": ""Red""}]"\n'
+            "Phone,Телефон,Qisqa,Tavsif,12,Brand,,,\n",
+        )
+        stdout, _ = self.run_import(path)
+        self.assertIn("Created 2 products, rejected 0 rows", stdout)
+
+        product = Product.objects.get(slug="phone")
+        self.assertEqual(product.title_ru, "Телефон")
+        self.assertEqual(product.effective_price, Decimal("10.50"))
+        self.assertEqual(product.brand_id.title, "Acme")
+        self.assertEqual(list(product.categories.all()), [self.category])
+        self.assertEqual(
+            list(product.product_images.values_list("image", "order")),
+            [("a.webp", 0), ("b.png", 1)],
+        )
+        # Converted and downsized in the background
+        self.assertCountEqual(
+            ImageJob.objects.filter(
+                object_id__in=product.product_images.values("id")
+            ).values_list("source", flat=True),
+            ["a.webp", "b.png"],
+        )
+        self.assertEqual(product.product_details.get().value_en, "Red")
+        self.assertIsNotNone(product.search_vector)
+        # Brands are matched by title
+        self.assertEqual(
+            Product.objects.get(slug="phone-2").brand_id,
+            Brand.objects.get(title="Brand"),
+        )
+
+    def test_jsonl_slugs_and_errors(self):
+        path = self.write_jsonl(
+            {"title_en": "Product 0"},
+            {"title_en": "Product 0"},
+            {"title_en": "Other", "slug": "product-0"},
+            {"title_en": "Other", "price": "-1"},
+            {"title_en": "Other", "categories": ["no"]},
+            {"title_en": "Other", "title_ru": ""},
+        )
+        with open(path, "a", encoding="utf-8") as file:
+            file.write("{\n")
+        stdout, stderr = self.run_import(path, "--chunk-size=2")
+        self.assertIn("Created 2 products, rejected 5 rows", stdout)
+        self.assertEqual(
+            sorted(Product.objects.values_list("slug", flat=True)),
+            ["product-0", "product-0-2", "product-0-3"],
+        )
+        for line in [3, 4, 5, 6, 7]:
+            self.assertIn(f"Line {line}:", stderr)
+        self.assertIn("Unknown categories: no", stderr)
+        self.assertIn("title_ru", stderr)
+
+    def test_dry_run(self):
+        stdout, _ = self.run_import(
+            self.write_jsonl({"title_en": "New", "brand": "New"}), "--dry-run"
+        )
+        self.assertIn("Created 0 products", stdout)
+        self.assertFalse(Product.objects.filter(title_en="New").exists())
+        self.assertFalse(Brand.objects.filter(title="New").exists())
+
+    def test_queries_do_not_depend_on_rows(self):
+        def count_queries(rows):
+            path = self.write_jsonl(
+                *[
+                    {"title_en": f"New {index}", "images": ["a.webp"]}
+                    for index in range(rows)
+                ]
+            )
+            with CaptureQueriesContext(connection) as queries:
+                self.run_import(path)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(10))
+        self.assertEqual(Product.objects.filter(title_en__startswith="New").count(), 12)
+
+    def test_invalidates_listing(self):
+        response = self.client.get(reverse("product_list"))
+        self.assertEqual(len(response.data["results"]), 1)
+        self.run_import(self.write_jsonl({"title_en": "New"}))
+        response = self.client.get(reverse("product_list"))
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_admin_upload(self):
+        admin = get_user_model().objects.create_superuser(
+            email="admin@example.com", password="password"
+        )
+        self.client.force_login(admin)
+        url = reverse("admin:products_product_import")
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        with open(self.write_jsonl({"title_en": "Uploaded"}), "rb") as file:
+            response = self.client.post(url, {"file": file, "format": "jsonl"})
+        self.assertRedirects(response, reverse("admin:products_product_changelist"))
+        self.assertTrue(Product.objects.filter(slug="uploaded").exists())
+
+
+def list_files(directory):
+    """Names of the files of default_storage under directory"""
+    directories, files = default_storage.listdir(directory)
+    names = {f"{directory}/{name}" for name in files}
+    for name in directories:
+        names |= list_files(f"{directory}/{name}")
+    return names
+
+
+class ReencodeImagesTestCase(TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.checkpoint = os.path.join(media_root, "checkpoint.json")
+
+        brand = Brand.objects.create(title="Brand")
+        self.product = Product.objects.create(
+            title_ru="Product",
+            title_en="Product",
+            short_description="Short",
+            description="Description",
+            price=10,
+            brand_id=brand,
+        )
+        self.images = [
+            ProductImage.objects.create(
+                product_id=self.product,
+                image=make_png(f"{index}.png", color),
+                order=index,
+            )
+            for index, color in enumerate(["red", "green", "blue"])
+        ]
+        self.file = File.objects.create(file=make_png("logo.png"))
+
+    def reencode(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            "reencode_images",
+            "--workers=2",
+            "--batch-size=2",
+            f"--checkpoint={self.checkpoint}",
+            *args,
+            stdout=stdout,
+            stderr=stderr,
+        )
+        return stdout.getvalue()
+
+    def test_converts_every_image(self):
+        originals = [image.image.name for image in self.images]
+        output = self.reencode()
+
+        self.assertIn("products.productimage: 3 processed, 1 updated", output)
+        self.assertIn("common.file: 1 processed, 1 updated", output)
+        for image in ProductImage.objects.all():
+            self.assertTrue(image.image.name.endswith(".webp"))
+            self.assertEqual(set(image.variants), {"160", "320", "400"})
+        self.file.refresh_from_db()
+        self.assertTrue(self.file.file.name.endswith(".webp"))
+        for name in originals:
+            self.assertFalse(default_storage.exists(name))
+        # Finished, nothing left to resume
+        with open(self.checkpoint) as file:
+            self.assertEqual(json.load(file), {})
+
+        # Up to date images are skipped unless forced
+        self.assertIn("3 processed, 1 updated", self.reencode("--force"))
+        self.assertNotIn("products.productimage", self.reencode())
+
+    def test_resumes_after_checkpoint(self):
+        first = min(self.images, key=lambda image: image.pk)
+        with open(self.checkpoint, "w") as file:
+            json.dump({"products.productimage": str(first.pk)}, file)
+
+        self.reencode("--models", "products.productimage")
+
+        first.refresh_from_db()
+        self.assertTrue(first.image.name.endswith(".png"))
+        self.assertEqual(
+            ProductImage.objects.filter(image__endswith=".webp").count(), 2
+        )
+
+    def test_leaves_rows_changed_meanwhile(self):
+        image = self.images[0]
+        source = image.image.name
+        swap = ReencodeImagesCommand.swap
+
+        def upload_while_converting(command, model, *args):
+            # Another file is uploaded while the pool converts the batch
+            if model is ProductImage:
+                ProductImage.objects.filter(pk=image.pk).update(image="other.webp")
+            return swap(command, model, *args)
+
+        with mock.patch.object(
+            ReencodeImagesCommand,
+            "swap",
+            autospec=True,
+            side_effect=upload_while_converting,
+        ):
+            self.reencode("--models", "products.productimage")
+
+        image.refresh_from_db()
+        self.assertEqual(image.image.name, "other.webp")
+        # The source is left alone and the files written for it are removed
+        referenced = {source}
+        for image in ProductImage.objects.exclude(pk=image.pk):
+            referenced |= {image.image.name, *image.variants.values()}
+        self.assertEqual(list_files("uploads/products/files"), referenced)
+
+    def test_leaves_rows_whose_files_were_discarded(self):
+        image = self.images[0]
+        source = image.image.name
+        swap = ReencodeImagesCommand.swap
+        written = set()
+
+        def discard_while_converting(command, model, field_name, rows, results):
+            # The last other reference to a written file released meanwhile
+            results = list(results)
+            for (pk, _, _), (_, names, _) in zip(rows, results):
+                if model is ProductImage and pk == image.pk:
+                    written.update(set(names.values()) - {source})
+                    default_storage.delete(names["160"])
+            return swap(command, model, field_name, rows, results)
+
+        with mock.patch.object(
+            ReencodeImagesCommand,
+            "swap",
+            autospec=True,
+            side_effect=discard_while_converting,
+        ):
+            self.reencode("--models", "products.productimage")
+
+        image.refresh_from_db()
+        self.assertEqual(image.image.name, source)
+        self.assertEqual(
+            ProductImage.objects.filter(image__endswith=".webp").count(), 2
+        )
+        # The references taken for the check are given back
+        self.assertFalse(
+            StoredFile.objects.filter(name__in=written, references__gt=0).exists()
+        )
+
+    def test_shared_files_are_kept(self):
+        # The same bytes as the first image
+        copy = ProductImage.objects.create(
+            product_id=self.product, image=make_png("copy.png"), order=3
+        )
+        self.assertEqual(copy.image.name, self.images[0].image.name)
+
+        self.reencode("--models", "products.productimage")
+
+        copy.refresh_from_db()
+        image = ProductImage.objects.get(pk=self.images[0].pk)
+        self.assertEqual(
+            (copy.image.name, copy.variants), (image.image.name, image.variants)
+        )
+        self.assertEqual(StoredFile.objects.get(name=image.image.name).references, 2)
+
+        image.delete()
+        for name in copy.variants.values():
+            self.assertTrue(default_storage.exists(name))
+        copy.delete()
+        for name in copy.variants.values():
+            self.assertFalse(default_storage.exists(name))
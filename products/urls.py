@@ -1,13 +1,28 @@
 from django.urls import path
 
-from .views import ListCategoryAPIView, ListProductAPIView, ProductDetailAPIView
+from .views import (
+    ListCategoryAPIView,
+    ListProductAPIView,
+    ProductBatchAPIView,
+    ProductDetailAPIView,
+    ProductExportAPIView,
+    SuggestAPIView,
+)
 
 urlpatterns = [
     path("categories/", ListCategoryAPIView.as_view(), name="category_list"),
     path("", ListProductAPIView.as_view(), name="product_list"),
+    path("suggest/", SuggestAPIView.as_view(), name="product_suggest"),
+    path("batch/", ProductBatchAPIView.as_view(), name="product_batch"),
+    path("export/", ProductExportAPIView.as_view(), name="product_export"),
     path(
         "product/<uuid:product_id>/",
         ProductDetailAPIView.as_view(),
         name="product_detail",
     ),
+    path(
+        "product/<slug:slug>/",
+        ProductDetailAPIView.as_view(),
+        name="product_detail_slug",
+    ),
 ]
@@ -1,15 +1,43 @@
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 from django.utils import translation
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.pagination import PageNumberPagination
 
-from .models import Category, Product
+from common.images import get_requested_width
+from utils.cache import get_or_set_tagged, model_tag
+from utils.conditional import conditional_on
+from utils.response_cache import cache_response
+from utils.serializers import get_sparse_fields
+
+from .models import (
+    CATEGORY_TREE_TAG,
+    Brand,
+    Category,
+    Product,
+    ProductDetail,
+    ProductDiscount,
+    ProductImage,
+    product_tag,
+)
+from .export import FEEDS, iter_feed
+from .facets import FACETS, get_facets
+from .fast_serializers import (
+    get_product_rows,
+    serialize_category_tree,
+    serialize_products,
+)
 from .filters import ProductFilter
+from .pagination import ProductCursorPagination
+from .search import suggest
 from .serializers import (
     CategorySerializer,
+    ProductBatchSerializer,
     ProductSerializer,
     ProductRetrieveSerializer as ProductDetailSerializer,
 )
@@ -19,6 +47,11 @@ from .serializers import (
 
 
 class ListCategoryAPIView(APIView):
+    cache_timeout = 60 * 60 * 24
+    # Build the tree from values() rows instead of CategorySerializer
+    fast_serialization = True
+
+    @conditional_on(CATEGORY_TREE_TAG)
     def get(self, request):
         is_carousel = request.query_params.get("is_carousel")
         lang = self.request.query_params.get("lang", None)
@@ -26,44 +59,258 @@ class ListCategoryAPIView(APIView):
         if lang in ["ru", "uz", "en"]:
             translation.activate(lang)
 
+        variant = is_carousel.lower() if is_carousel else "all"
+        if variant not in ["all", "true", "false"]:
+            return Response(status=status.HTTP_200_OK, data=[])
+
+        # Image URLs are absolute and follow ?img=, so the tree also depends
+        # on the host and the size hint
+        host = request.build_absolute_uri("/")
+        width = get_requested_width(request)
+        key = f"category-tree:{translation.get_language()}:{variant}:{host}:{width}"
+        data = get_or_set_tagged(
+            key,
+            [CATEGORY_TREE_TAG],
+            lambda: self.build_tree(request, variant),
+            timeout=self.cache_timeout,
+        )
+        return Response(status=status.HTTP_200_OK, data=data)
+
+    def build_tree(self, request, variant):
         categories = Category.objects.filter(parent__isnull=True)
+        if variant != "all":
+            categories = categories.filter(is_carousel=variant == "true")
 
-        if is_carousel:
-            if is_carousel.lower() == "true":
-                categories = categories.filter(is_carousel=True)
-            elif is_carousel.lower() == "false":
-                categories = categories.filter(is_carousel=False)
-            else:
-                categories = []
+        if self.fast_serialization:
+            return serialize_category_tree(categories, request)
 
+        brands = Brand.objects.order_by("title", "id")
+        categories = categories.select_related("image_id").prefetch_related(
+            Prefetch(
+                "children",
+                queryset=Category.objects.prefetch_related(
+                    Prefetch("brands", queryset=brands)
+                ),
+            )
+        )
         serializer = CategorySerializer(
             categories, many=True, context={"request": request}
         )
-        return Response(status=status.HTTP_200_OK, data=serializer.data)
+        return serializer.data
+
+
+def get_listing_queryset(request, queryset):
+    """
+    Products for ProductSerializer, without the joins, subqueries and
+    columns of the fields dropped by ?fields= / ?omit=. The description
+    is never shown in lists.
+    """
+    names = ProductSerializer.Meta.fields
+    fields = get_sparse_fields(request, names)
+    columns = {field.name for field in Product._meta.concrete_fields}
+    unused = [name for name in names if name not in fields and name in columns]
+    return queryset.for_listing(fields).localized(
+        "description", "search_vector", *unused
+    )
 
 
 class ListProductAPIView(ListAPIView):
-    queryset = Product.objects.all().order_by("id").distinct()
+    queryset = Product.objects.order_by("id")
     serializer_class = ProductSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = ProductFilter
     pagination_class = PageNumberPagination
+    # Build the page from values() rows instead of ProductSerializer
+    fast_serialization = True
+
+    # ProductDetail values are searched by ?q= through the search vector
+    cache_tags = [
+        model_tag(model)
+        for model in [
+            Product,
+            ProductDetail,
+            ProductImage,
+            ProductDiscount,
+            Category,
+            Brand,
+        ]
+    ]
+
+    @conditional_on(*cache_tags)
+    @cache_response(*cache_tags, params={"img": get_requested_width})
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return get_listing_queryset(self.request, super().get_queryset())
+
+    @property
+    def paginator(self):
+        """Opt into keyset pagination with ?pagination=cursor"""
+        if not hasattr(self, "_paginator"):
+            if self.request.query_params.get("pagination") == "cursor":
+                self._paginator = ProductCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_paginated_response(self, data):
         return self.paginator.get_paginated_response(data)
 
+    def list(self, request, *args, **kwargs):
+        if self.fast_serialization:
+            # Same output as ProductSerializer without model instances
+            fields = get_sparse_fields(request, ProductSerializer.Meta.fields)
+            queryset = self.filter_queryset(self.get_queryset())
+            rows = self.paginate_queryset(get_product_rows(queryset, fields))
+            data = serialize_products(rows, fields, request)
+            response = self.get_paginated_response(data)
+        else:
+            response = super().list(request, *args, **kwargs)
+
+        # ?facets=brand,category,price,stock
+        facets = request.query_params.get("facets", "").split(",")
+        facets = [facet.strip() for facet in facets if facet.strip() in FACETS]
+        if facets:
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data["facets"] = get_facets(queryset, facets)
+        return response
+
+
+def get_product_id(slug):
+    """Primary key of the product with the slug, None if there is none"""
+    return get_or_set_tagged(
+        f"product-slug:{slug}",
+        [model_tag(Product)],
+        lambda: Product.objects.filter(slug=slug).values_list("pk", flat=True).first(),
+    )
+
+
+def product_detail_tag(product_id=None, slug=None):
+    if product_id is None:
+        product_id = get_product_id(slug)
+    return product_tag(product_id)
+
 
 class ProductDetailAPIView(APIView):
-    def get(self, request, product_id):
+    cache_timeout = 60 * 60 * 24
+
+    @conditional_on(product_detail_tag)
+    def get(self, request, product_id=None, slug=None):
         lang = self.request.query_params.get("lang", None)
 
         if lang in ["ru", "uz", "en"]:
             translation.activate(lang)
 
-        product = Product.objects.filter(id=product_id).first()
-        if product is None:
+        if product_id is None:
+            product_id = get_product_id(slug)
+
+        data = None
+        if product_id is not None:
+            # Image URLs are absolute and follow ?img=, so the payload also
+            # depends on the host and the size hint
+            host = request.build_absolute_uri("/")
+            width = get_requested_width(request)
+            key = (
+                f"product-detail:{product_id}:{translation.get_language()}:{host}"
+                f":{width}"
+            )
+            data = get_or_set_tagged(
+                key,
+                [product_tag(product_id)],
+                lambda: self.build_detail(request, product_id),
+                timeout=self.cache_timeout,
+            )
+
+        if data is None:
             return Response(
                 status=status.HTTP_404_NOT_FOUND, data={"detail": "Product not found"}
             )
+        return Response(status=status.HTTP_200_OK, data=data)
+
+    def build_detail(self, request, product_id):
+        product = (
+            Product.objects.for_detail()
+            .localized("search_vector")
+            .filter(id=product_id)
+            .first()
+        )
+        if product is None:
+            return None
         serializer = ProductDetailSerializer(product, context={"request": request})
-        return Response(status=status.HTTP_200_OK, data=serializer.data)
+        return serializer.data
+
+
+class ProductBatchAPIView(APIView):
+    def get(self, request):
+        """Products for ?ids=a,b,c in the requested order"""
+        ids = request.query_params.get("ids", "").split(",")
+        ids = [product_id.strip() for product_id in ids if product_id.strip()]
+        return self.batch(request, {"ids": ids})
+
+    def post(self, request):
+        """Same as GET with {"ids": [...]} in the body, for long lists"""
+        return self.batch(request, request.data)
+
+    def batch(self, request, data):
+        serializer = ProductBatchSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data["ids"]))
+
+        queryset = get_listing_queryset(request, Product.objects.filter(pk__in=ids))
+        products = {product.pk: product for product in queryset}
+        found = [products[pk] for pk in ids if pk in products]
+        return Response(
+            status=status.HTTP_200_OK,
+            data={
+                "results": ProductSerializer(
+                    found, many=True, context={"request": request}
+                ).data,
+                "missing": [str(pk) for pk in ids if pk not in products],
+            },
+        )
+
+
+class ProductExportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+    chunk_size = 500
+
+    def get(self, request):
+        """Stream the whole catalog as ?feed=csv|jsonl|xml"""
+        feed = request.query_params.get("feed", "csv")
+        if feed not in FEEDS:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={"detail": f"Unknown feed, expected one of {', '.join(FEEDS)}"},
+            )
+
+        content_type, extension, _ = FEEDS[feed]
+        response = StreamingHttpResponse(
+            iter_feed(feed, request, self.chunk_size),
+            content_type=f"{content_type}; charset=utf-8",
+        )
+        response["Content-Disposition"] = f'attachment; filename="products.{extension}"'
+        return response
+
+
+class SuggestAPIView(APIView):
+    min_length = 2
+    default_limit = 5
+    max_limit = 10
+
+    @cache_response(*[model_tag(model) for model in [Product, Brand, Category]])
+    def get(self, request):
+        """Typo tolerant autocomplete for the search box"""
+        text = request.query_params.get("q", "").strip()
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        limit = min(max(limit, 1), self.max_limit)
+
+        if len(text) < self.min_length:
+            return Response(
+                status=status.HTTP_200_OK,
+                data={"products": [], "brands": [], "categories": []},
+            )
+        return Response(status=status.HTTP_200_OK, data=suggest(text, limit))
@@ -0,0 +1,50 @@
+import time
+
+from django.core.cache import cache
+
+TAG_KEY_PREFIX = "tag:"
+
+
+def model_tag(model):
+    """Tag of every cache entry built from the model's table"""
+    return f"table:{model._meta.label_lower}"
+
+
+def resolve_tags(tags, **kwargs):
+    """Tags are strings or callables taking the view's URL kwargs"""
+    return [tag(**kwargs) if callable(tag) else tag for tag in tags]
+
+
+def get_tag_versions(tags):
+    """Current version of every tag, a tag seen for the first time is created"""
+    keys = {f"{TAG_KEY_PREFIX}{tag}": tag for tag in tags}
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def invalidate_tags(*tags):
+    """Expire every cache entry depending on one of the tags"""
+    cache.set_many(
+        {f"{TAG_KEY_PREFIX}{tag}": time.time_ns() for tag in tags}, timeout=None
+    )
+
+
+def get_or_set_tagged(key, tags, default, timeout=None):
+    """
+    Return the cached value for key, calling default() to build it when it
+    is missing or one of its tags has been invalidated since it was stored.
+    """
+    entry = cache.get(key)
+    versions = get_tag_versions(tags)
+    if entry is not None and entry[0] == versions:
+        return entry[1]
+
+    # Versions are read before building, so a concurrent invalidation
+    # leaves the stored entry stale instead of hiding the change
+    value = default()
+    cache.set(key, (versions, value), timeout)
+    return value
@@ -0,0 +1,55 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer on top of orjson, byte for byte the same output. Falls back
+    to the stock renderer without orjson or when indentation is requested.
+    """
+
+    # Datetimes go through DRF's encoder to keep its formatting ("Z" for UTC)
+    options = (
+        (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            content = orjson.dumps(
+                data, default=JSONEncoder().default, option=self.options
+            )
+        except orjson.JSONEncodeError:
+            # Values orjson rejects, such as integers beyond 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Same as JSONRenderer, keep the output a valid JavaScript literal
+        return content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser on top of orjson, falls back to the stock parser"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
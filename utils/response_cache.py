@@ -0,0 +1,97 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import translation
+from rest_framework.response import Response
+
+from .cache import get_tag_versions, resolve_tags
+
+RESPONSE_KEY_PREFIX = "response:"
+STATS_KEYS = {"hits": "response-cache:hits", "misses": "response-cache:misses"}
+
+
+def get_response_key(request, params=None):
+    """
+    Cache key of a GET: host, path, sorted query string and language. The
+    values of params are replaced by what their function makes of the
+    request, so equivalent values share one entry.
+    """
+    params = params or {}
+    query = sorted(
+        (name, value)
+        for name, values in request.GET.lists()
+        if name not in params
+        for value in values
+        if value != ""
+    )
+    query += [(name, str(params[name](request))) for name in sorted(params)]
+    # LanguageMiddleware has already activated a valid ?lang=
+    parts = [
+        request.get_host(),
+        request.path,
+        repr(query),
+        translation.get_language(),
+    ]
+    return RESPONSE_KEY_PREFIX + hashlib.md5("|".join(parts).encode()).hexdigest()
+
+
+def increment_stat(name):
+    key = STATS_KEYS[name]
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def get_response_cache_stats():
+    """Hit and miss counters of the response cache"""
+    stats = cache.get_many(STATS_KEYS.values())
+    return {name: stats.get(key, 0) for name, key in STATS_KEYS.items()}
+
+
+def reset_response_cache_stats():
+    cache.delete_many(STATS_KEYS.values())
+
+
+def cache_response(*tags, timeout=None, params=None):
+    """
+    Cache the data of successful anonymous GETs answered by the decorated
+    view method. The entry is dropped as soon as one of its tags is
+    invalidated, tags may be callables of the URL kwargs. params maps query
+    parameters to a function normalizing them for the key, see
+    get_response_key().
+    """
+
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method != "GET" or request.user.is_authenticated:
+                return view_method(self, request, *args, **kwargs)
+
+            key = get_response_key(request, params)
+            entry = cache.get(key)
+            versions = get_tag_versions(resolve_tags(tags, **kwargs))
+            if entry is not None and entry[0] == versions:
+                increment_stat("hits")
+                response = Response(status=entry[1], data=entry[2])
+                response["X-Cache"] = "HIT"
+                return response
+
+            increment_stat("misses")
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200 and isinstance(response, Response):
+                cache.set(
+                    key,
+                    (versions, response.status_code, response.data),
+                    timeout if timeout is not None else settings.RESPONSE_CACHE_TIMEOUT,
+                )
+            response["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,46 @@
+def parse_field_list(value):
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+def get_sparse_fields(request, names, prefix=""):
+    """
+    Names kept by ?fields= and ?omit=, both comma separated. Dotted names
+    such as products.title reach the fields of nested serializers.
+    """
+    if request is None:
+        return list(names)
+
+    requested = parse_field_list(request.query_params.get("fields", ""))
+    omitted = parse_field_list(request.query_params.get("omit", ""))
+    path = f"{prefix}." if prefix else ""
+
+    # Nothing asked at this level, or the whole nested object was asked for
+    if requested and prefix not in requested:
+        inner = {name[len(path) :] for name in requested if name.startswith(path)}
+        if inner:
+            names = [
+                name
+                for name in names
+                if name in inner or any(i.startswith(f"{name}.") for i in inner)
+            ]
+    return [name for name in names if f"{path}{name}" not in omitted]
+
+
+class SparseFieldsMixin:
+    """Serializer mixin dropping the fields excluded by ?fields= / ?omit="""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        kept = get_sparse_fields(
+            self.context.get("request"), list(fields), self.get_field_path()
+        )
+        return {name: field for name, field in fields.items() if name in kept}
+
+    def get_field_path(self):
+        names = []
+        node = self
+        while node is not None:
+            if getattr(node, "field_name", None):
+                names.append(node.field_name)
+            node = getattr(node, "parent", None)
+        return ".".join(reversed(names))